@@ -0,0 +1,31 @@
+from django.utils.functional import SimpleLazyObject
+from utils.middleware import get_request_pipeline
+from cart.utils import cart_owner, cart_key, touch_cart
+
+
+def _get_cart_count(request):
+    owner = cart_owner(request)
+    pipeline = get_request_pipeline(request)
+
+    if owner is None:
+        # 未登录且没有会话时购物车数目为 0,但仍需执行视图中已放入 pipeline 的命令
+        if len(pipeline):
+            pipeline.execute()
+        return 0
+
+    # 购物车记录使用 hash 方式存储, cart_userid 用作 hash 的键,商品 sku 用作属性,商品的数量用作值
+    # 未登录用户使用会话中的购物车
+    # hlen 获取购物车条目数,与视图放入的其他命令一起,一次发送给 redis
+    # 同时刷新购物车的过期时间
+    index = len(pipeline)
+    pipeline.hlen(cart_key(owner))
+    touch_cart(pipeline, owner)
+    return pipeline.execute()[index]
+
+
+def cart_count(request):
+    """
+    所有页面头部的购物车数目
+    使用惰性对象,只有模板中用到 cart_count 时才会访问 redis
+    """
+    return {'cart_count': SimpleLazyObject(lambda: _get_cart_count(request))}
@@ -1,3 +1,98 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from django_redis import get_redis_connection
+from goods.stock import SKU_STOCK_KEY
+from cart.utils import add_cart, update_cart, merge_cart, cart_key, cart_count_key, \
+    CART_OK, CART_NOT_EXIST, CART_NO_STOCK
 
 # Create your tests here.
+
+# 购物车测试使用单独的 redis 数据库,每个测试前后清空
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/15",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    }
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CartScriptTest(SimpleTestCase):
+    """购物车 lua 脚本,只访问 redis,不需要数据库"""
+
+    def setUp(self):
+        self.conn = get_redis_connection('default')
+        self.conn.flushdb()
+        # 在售商品库存: 商品 1 库存 5,商品 2 库存 10,商品 3 已售罄
+        self.conn.hmset(SKU_STOCK_KEY, {1: 5, 2: 10, 3: 0})
+
+    def tearDown(self):
+        self.conn.flushdb()
+
+    def hgetall(self, owner):
+        return {int(sku_id): int(count) for sku_id, count in self.conn.hgetall(cart_key(owner)).items()}
+
+    def test_add_over_stock(self):
+        """累加后超过库存时设置为库存数"""
+        self.assertEqual(add_cart(1, 1, 3), (CART_OK, 3, 1, 3))
+        self.assertEqual(add_cart(1, 1, 4), (CART_OK, 5, 1, 5))
+        self.assertEqual(add_cart(1, 2, 20), (CART_OK, 10, 2, 15))
+        self.assertEqual(self.hgetall(1), {1: 5, 2: 10})
+        self.assertEqual(int(self.conn.get(cart_count_key(1))), 15)
+
+    def test_add_missing_or_sold_out(self):
+        self.assertEqual(add_cart(1, 4, 1), (CART_NOT_EXIST, 0, 0, 0))
+        self.assertEqual(add_cart(1, 3, 1), (CART_NO_STOCK, 0, 0, 0))
+        self.assertEqual(self.hgetall(1), {})
+
+    def test_update_to_zero(self):
+        """数量设置为 0 时不修改购物车,返回库存不足和原有数量"""
+        add_cart(1, 1, 2)
+        self.assertEqual(update_cart(1, 1, 0), (CART_NO_STOCK, 2, 1, 2))
+        self.assertEqual(self.hgetall(1), {1: 2})
+
+    def test_update_over_stock(self):
+        add_cart(1, 1, 2)
+        self.assertEqual(update_cart(1, 1, 8), (CART_OK, 5, 1, 5))
+        self.assertEqual(update_cart(1, 1, 1), (CART_OK, 1, 1, 1))
+
+    def test_merge_into_user_cart(self):
+        """未登录购物车合并到已有的用户购物车,数量累加且不超过库存,已下架的商品被丢弃,合并后删除未登录购物车"""
+        guest = 'guest_abc'
+        add_cart(1, 1, 2)
+        add_cart(guest, 1, 4)
+        add_cart(guest, 2, 1)
+        # 商品 4 加入购物车后下架
+        self.conn.hset(cart_key(guest), 4, 1)
+
+        self.assertEqual(merge_cart(guest, 1), (2, 6))
+        self.assertEqual(self.hgetall(1), {1: 5, 2: 1})
+        self.assertEqual(int(self.conn.get(cart_count_key(1))), 6)
+        self.assertFalse(self.conn.exists(cart_key(guest)))
+        self.assertFalse(self.conn.exists(cart_count_key(guest)))
+
+    def test_count_initialized(self):
+        """商品总数不存在时(该功能上线前的购物车)根据购物车记录计算"""
+        self.conn.hmset(cart_key(1), {1: 2, 2: 3})
+        self.assertEqual(add_cart(1, 2, 1), (CART_OK, 4, 2, 6))
+
+    def test_ttl_refreshed(self):
+        """每次修改购物车时刷新过期时间,未登录购物车使用较短的过期时间"""
+        guest = 'guest_abc'
+        add_cart(1, 1, 1)
+        add_cart(guest, 1, 1)
+        for owner in (1, guest):
+            self.conn.expire(cart_key(owner), 10)
+            self.conn.expire(cart_count_key(owner), 10)
+
+        add_cart(1, 2, 1)
+        update_cart(guest, 1, 2)
+
+        for key in (cart_key(1), cart_count_key(1)):
+            self.assertGreater(self.conn.ttl(key), settings.CART_TIMEOUT - 10)
+        for key in (cart_key(guest), cart_count_key(guest)):
+            self.assertGreater(self.conn.ttl(key), settings.GUEST_CART_TIMEOUT - 10)
+            self.assertLessEqual(self.conn.ttl(key), settings.GUEST_CART_TIMEOUT)
@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from cart.views import AddCartView, CartInfoView, UpdateCartView, DeleteCartView
+from cart.views import AddCartView, CartInfoView, UpdateCartView, DeleteCartView, BatchCartView, CartCountView
 
 
 urlpatterns = [
@@ -7,4 +7,6 @@ urlpatterns = [
     url(r'^$', CartInfoView.as_view(), name='info'),  # 购物车页面
     url(r'^update$', UpdateCartView.as_view(), name='update'),  # 购物车页面更新
     url(r'^delete$', DeleteCartView.as_view(), name='delete'),  # 删除购物车
+    url(r'^batch$', BatchCartView.as_view(), name='batch'),  # 批量修改购物车
+    url(r'^count$', CartCountView.as_view(), name='count'),  # 购物车数目(静态页面使用)
 ]
@@ -0,0 +1,308 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods.stock import SKU_STOCK_KEY, ensure_sku_stock
+
+
+# 购物车所有者 owner
+# 登录用户为用户 id,未登录用户为 guest_会话id,未登录用户的购物车在登录时合并到用户的购物车中
+
+def cart_owner(request, create=False):
+    """
+    获取当前请求的购物车所有者
+    create: 未登录用户还没有会话时,是否创建会话,只有修改购物车时才需要创建
+    未登录用户没有会话且不创建时返回 None
+    """
+    if request.user.is_authenticated():
+        return request.user.id
+
+    session_key = request.session.session_key
+    if session_key is None:
+        if not create:
+            return None
+        # 空会话不会被保存,也不会设置 cookie,写入一个标记后再保存,以生成会话 id
+        request.session['guest_cart'] = True
+        request.session.save()
+        session_key = request.session.session_key
+    return 'guest_%s' % session_key
+
+
+def is_guest(owner):
+    return isinstance(owner, str)
+
+
+def cart_key(owner):
+    """购物车记录使用 hash 方式存储, cart_userid 用作 hash 的键,商品 sku 用作属性,商品的数量用作值"""
+    return 'cart_%s' % owner
+
+
+def cart_count_key(owner):
+    """购物车商品总数,随购物车的增删改同时更新,不必每次都累加 hash 里所有的值"""
+    return 'cart_count_%s' % owner
+
+
+# 购物车修改结果
+CART_OK = 0
+# 商品不存在
+CART_NOT_EXIST = 1
+# 商品库存不足
+CART_NO_STOCK = 2
+
+# 购物车修改脚本
+# 使用 lua 脚本在 redis 中原子地完成 校验商品、限制数量不超过库存、修改购物车记录、更新商品总数,
+# 多个页面同时修改购物车时不会丢失修改,且整个过程只有一次网络往返,不需要查询数据库
+# KEYS[1]: 购物车 hash, KEYS[2]: 商品总数, KEYS[3]: 在售商品库存 hash(goods.stock.SKU_STOCK_KEY)
+# ARGV[1] 为购物车的过期时间,脚本开始时取出,修改完成后在脚本中刷新购物车的过期时间,不需要额外的命令
+# 在售商品库存不存在时(部署后、redis 清空后)不做任何修改,返回 STOCK_MISSING,重建后再执行一次
+# 商品总数不存在时(如该功能上线前的购物车),先根据购物车记录计算一次
+STOCK_MISSING = -1
+
+CART_TTL = """
+local ttl = table.remove(ARGV, 1)
+
+local function touch()
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+"""
+
+CHECK_STOCK = """
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    return -1
+end
+"""
+
+INIT_COUNT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local total = 0
+    for _, count in ipairs(redis.call('HVALS', KEYS[1])) do
+        total = total + tonumber(count)
+    end
+    redis.call('SET', KEYS[2], total)
+end
+"""
+
+# 单条购物车记录的修改函数,供下面的脚本共用
+# set_line: 设置商品数量,数量超过库存时设置为库存数,incr 为 true 时在原有数量上累加,返回 (修改结果, 商品数量)
+# delete_line: 删除商品
+CART_LINE = """
+local function set_line(sku_id, count, incr)
+    local stock = redis.call('HGET', KEYS[3], sku_id)
+    if not stock then
+        return 1, 0
+    end
+
+    local old = tonumber(redis.call('HGET', KEYS[1], sku_id) or 0)
+    if incr then
+        count = count + old
+    end
+    count = math.min(count, tonumber(stock))
+    if count <= 0 then
+        return 2, old
+    end
+
+    redis.call('HSET', KEYS[1], sku_id, count)
+    redis.call('INCRBY', KEYS[2], count - old)
+    return 0, count
+end
+
+local function delete_line(sku_id)
+    local old = redis.call('HGET', KEYS[1], sku_id)
+    if old then
+        redis.call('HDEL', KEYS[1], sku_id)
+        redis.call('INCRBY', KEYS[2], -tonumber(old))
+    end
+end
+"""
+
+# 设置单个商品数量
+# ARGV[1]: sku_id, ARGV[2]: 数量, ARGV[3]: 为 1 时在原有数量上累加,为 0 时直接设置
+# 返回 {修改结果, 商品数量, 购物车条目数, 商品总数}
+SET_SCRIPT = CART_TTL + CHECK_STOCK + INIT_COUNT + CART_LINE + """
+local status, count = set_line(ARGV[1], tonumber(ARGV[2]), ARGV[3] == '1')
+touch()
+return {status, count, redis.call('HLEN', KEYS[1]), tonumber(redis.call('GET', KEYS[2]))}
+"""
+
+# 删除商品 ARGV: 要删除的 sku_id,返回商品总数
+DELETE_SCRIPT = CART_TTL + INIT_COUNT + CART_LINE + """
+for _, sku_id in ipairs(ARGV) do
+    delete_line(sku_id)
+end
+touch()
+return tonumber(redis.call('GET', KEYS[2]))
+"""
+
+# 批量修改购物车
+# ARGV 每 3 个一组: 操作(add/update/delete), sku_id, 数量
+# 返回 {{修改结果, 商品数量}..., 购物车条目数, 商品总数}
+BATCH_SCRIPT = CART_TTL + CHECK_STOCK + INIT_COUNT + CART_LINE + """
+local results = {}
+for i = 1, #ARGV, 3 do
+    local op, sku_id = ARGV[i], ARGV[i + 1]
+    if op == 'delete' then
+        delete_line(sku_id)
+        table.insert(results, {0, 0})
+    else
+        local status, count = set_line(sku_id, tonumber(ARGV[i + 2]), op == 'add')
+        table.insert(results, {status, count})
+    end
+end
+touch()
+table.insert(results, redis.call('HLEN', KEYS[1]))
+table.insert(results, tonumber(redis.call('GET', KEYS[2])))
+return results
+"""
+
+# 合并购物车,将 KEYS[4](未登录购物车 hash), KEYS[5](未登录购物车商品总数) 合并到用户购物车后删除
+# 同一商品的数量累加,超过库存时设置为库存数,已下架的商品被丢弃
+# 返回 {购物车条目数, 商品总数}
+MERGE_SCRIPT = CART_TTL + CHECK_STOCK + INIT_COUNT + CART_LINE + """
+local items = redis.call('HGETALL', KEYS[4])
+for i = 1, #items, 2 do
+    set_line(items[i], tonumber(items[i + 1]), true)
+end
+redis.call('DEL', KEYS[4], KEYS[5])
+touch()
+return {redis.call('HLEN', KEYS[1]), tonumber(redis.call('GET', KEYS[2]))}
+"""
+
+# 批量修改支持的操作
+CART_OPS = ('add', 'update', 'delete')
+
+
+def _cart_keys(owner):
+    return [cart_key(owner), cart_count_key(owner), SKU_STOCK_KEY]
+
+
+def cart_timeout(owner):
+    """购物车的过期时间,每次访问购物车时刷新,长时间不活跃的购物车自动过期,redis 占用的内存只与活跃用户数相关"""
+    return settings.GUEST_CART_TIMEOUT if is_guest(owner) else settings.CART_TIMEOUT
+
+
+def touch_cart(pipeline, owner):
+    """刷新购物车的过期时间,命令放入 pipeline,由调用方统一发送"""
+    timeout = cart_timeout(owner)
+    pipeline.expire(cart_key(owner), timeout)
+    pipeline.expire(cart_count_key(owner), timeout)
+
+
+def _execute(owner, script, keys, args):
+    """
+    执行购物车修改脚本,过期时间作为第一个参数传入,在脚本中刷新
+    脚本不放入 pipeline(pipeline 执行脚本前会先发送 script exists),evalsha 只有一次网络往返
+    """
+    conn = get_redis_connection('default')
+    return conn.register_script(script)(keys=keys, args=[cart_timeout(owner)] + list(args))
+
+
+def _run_script(owner, script, args, extra_keys=()):
+    """执行购物车修改脚本,在售商品库存不存在时重建后再执行一次"""
+    keys = _cart_keys(owner) + list(extra_keys)
+    result = _execute(owner, script, keys, args)
+    if result == STOCK_MISSING:
+        ensure_sku_stock()
+        result = _execute(owner, script, keys, args)
+    return result
+
+
+def add_cart(owner, sku_id, count):
+    """
+    添加商品,在购物车原有数量上累加
+    返回 (修改结果, 商品数量, 购物车条目数, 商品总数)
+    """
+    result = _run_script(owner, SET_SCRIPT, [sku_id, count, 1])
+    if result == STOCK_MISSING:
+        # 没有在售商品
+        return CART_NOT_EXIST, 0, 0, 0
+    return tuple(result)
+
+
+def update_cart(owner, sku_id, count):
+    """
+    更新商品数量
+    返回 (修改结果, 商品数量, 购物车条目数, 商品总数)
+    """
+    result = _run_script(owner, SET_SCRIPT, [sku_id, count, 0])
+    if result == STOCK_MISSING:
+        # 没有在售商品
+        return CART_NOT_EXIST, 0, 0, 0
+    return tuple(result)
+
+
+def delete_cart(owner, *sku_ids):
+    """删除商品,返回商品总数"""
+    return _run_script(owner, DELETE_SCRIPT, sku_ids)
+
+
+def batch_cart(owner, operations):
+    """
+    批量修改购物车,所有操作在一个 lua 脚本中按顺序原子地执行
+    operations: [(sku_id, 数量, 操作)],操作为 add(累加), update(设置), delete(删除, 数量被忽略)
+    返回 ([(修改结果, 商品数量)], 购物车条目数, 商品总数)
+    """
+    args = []
+    for sku_id, count, op in operations:
+        args.extend([op, sku_id, count])
+
+    result = _run_script(owner, BATCH_SCRIPT, args)
+    if result == STOCK_MISSING:
+        return [(CART_NOT_EXIST, 0) for operation in operations], 0, 0
+    lines, total_count = result[-2:]
+    return [tuple(item) for item in result[:-2]], lines, total_count
+
+
+def merge_cart(guest, user_id):
+    """
+    登录时将未登录购物车合并到用户购物车,一次 lua 脚本完成,不查询数据库
+    返回 (购物车条目数, 商品总数)
+    """
+    result = _run_script(user_id, MERGE_SCRIPT, [], [cart_key(guest), cart_count_key(guest)])
+    if result == STOCK_MISSING:
+        return 0, 0
+    return tuple(result)
+
+
+def get_cart_skus(owner, sku_ids=None):
+    """
+    获取购物车商品,购物车页面和订单确认页面共用
+    sku_ids: 只获取指定的商品,为 None 时获取整个购物车
+    redis 只访问一次(hgetall 或 hmget,同时刷新过期时间),数据库只查询一次(in_bulk),查询次数不随商品数目增加
+    返回 (商品列表, 商品总数, 商品总价),商品动态添加 count(数量) 和 amount(小计) 属性
+    """
+    pl = get_redis_connection('default').pipeline(transaction=False)
+
+    if sku_ids is None:
+        pl.hgetall(cart_key(owner))
+        touch_cart(pl, owner)
+        counts = pl.execute()[0]
+        sku_ids = [int(sku_id) for sku_id in counts]
+        counts = [counts[sku_id] for sku_id in counts]
+    else:
+        sku_ids = [int(sku_id) for sku_id in sku_ids]
+        if sku_ids:
+            pl.hmget(cart_key(owner), sku_ids)
+            touch_cart(pl, owner)
+            counts = pl.execute()[0]
+        else:
+            counts = []
+
+    skus_map = GoodsSKU.objects.in_bulk(sku_ids)
+
+    skus = []
+    total_count = 0
+    total_amount = 0
+    for sku_id, count in zip(sku_ids, counts):
+        sku = skus_map.get(sku_id)
+        # 商品已被删除或购物车中没有该商品时跳过
+        if sku is None or count is None:
+            continue
+        # 动态添加商品数量和小计
+        sku.count = int(count)
+        sku.amount = sku.count * sku.price
+        skus.append(sku)
+        # 计算商品总价,总数目
+        total_count += sku.count
+        total_amount += sku.amount
+
+    return skus, total_count, total_amount
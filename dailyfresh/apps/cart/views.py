@@ -1,12 +1,15 @@
 from django.shortcuts import render
+from django.conf import settings
 from django.views.generic import View
 from django.http.response import JsonResponse
-from django_redis import get_redis_connection
 from django.core.urlresolvers import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django_redis import get_redis_connection
 from django.shortcuts import render
 
-from goods.models import GoodsSKU
-from utils.mixin import LoginRequiredMixin
+from cart.utils import cart_owner, cart_key, touch_cart, get_cart_skus, add_cart, update_cart, delete_cart, batch_cart, CART_OPS, CART_NOT_EXIST, CART_NO_STOCK
+import json
 
 
 # /cart/add
@@ -18,10 +21,8 @@ class AddCartView(View):
     前后端交互方式: ajax,一种不提交地址栏,且只会在后台发生变化的方式
     """
     def post(self, request):
-        # 判断用户是否登录
-        user = request.user
-        if not user.is_authenticated():
-            return JsonResponse({'res': 0, 'errmsg': '未登录'})
+        # 获取购物车所有者,未登录用户使用会话中的购物车,登录时合并到用户的购物车
+        owner = cart_owner(request, create=True)
 
         # 接收数据
         sku_id = request.POST.get('sku_id')
@@ -37,54 +38,35 @@ class AddCartView(View):
         except Exception as e:
             return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
 
+        if count <= 0:
+            return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
+
+        # 业务处理,添加购物车
+        # 如果 redis 里有该商品的记录,则对其数目进行累加,否则添加新的记录,同时更新购物车商品总数
+        # 商品是否存在、库存是否足够都在 redis 中校验,不需要查询数据库
+        status, count, lines, total_count = add_cart(owner, sku_id, count)
+
         # 检验商品是否存在
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except GoodsSKU.DoesNotExist:
+        if status == CART_NOT_EXIST:
             return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
-        # 业务处理,添加购物车
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
-
-        # 向 redis 里设置购物车记录
-        # 如果 redis 里有该商品的记录,则对其数目进行累加,否则添加新的记录
-        num = conn.hget(cart_key, sku.id)
-        if num:
-            # 由于 redis 里存储的都是 str 数据,因此需要转化成 int
-            count += int(num)
-
-        # hset 有则更新,无则添加
-        conn.hset(cart_key, sku.id, count)
-        # 返回购物车里所有条目数
-        count = int(conn.hlen(cart_key))
-        # 返回应答
-        return JsonResponse({'res': 4, 'errmsg': '添加成功', 'count': count})
+        if status == CART_NO_STOCK:
+            return JsonResponse({'res': 5, 'errmsg': '商品库存不足'})
+
+        # 返回应答,count 为购物车条目数(页面头部的购物车数目), sku_count 为该商品在购物车中的数量
+        return JsonResponse({'res': 4, 'errmsg': '添加成功', 'count': lines, 'sku_count': count, 'total_count': total_count})
 
 
 # /cart
-class CartInfoView(LoginRequiredMixin, View):
-    """购物车内容展示页面"""
+class CartInfoView(View):
+    """购物车内容展示页面,未登录用户展示会话中的购物车"""
     def get(self, request):
-        # 获取所有购物车商品数量
-        user = request.user
-        cart_key = 'cart_%d' % user.id
-        conn = get_redis_connection('default')
-
-        # 获取商品信息
-        goods_list = []
-        total_acount = 0
-        total_count = 0
-        for sku_id, count in conn.hgetall(cart_key).items():
-            # 动态添加商品数量
-            sku = GoodsSKU.objects.get(id=sku_id)
-            sku.count = int(count)
-            # 动态添加商品小计
-            sku.cost = sku.count * sku.price
-            goods_list.append(sku)
-            # 计算商品总价,总数目
-            total_acount += sku.cost
-            total_count += sku.count
+        # 获取所有购物车商品,一次读取 redis,一次查询数据库
+        owner = cart_owner(request)
+        if owner is None:
+            goods_list, total_count, total_acount = [], 0, 0
+        else:
+            goods_list, total_count, total_acount = get_cart_skus(owner)
 
         context = {'goods_list': goods_list,
                    'total_acount': total_acount,
@@ -102,10 +84,8 @@ class UpdateCartView(View):
     """
 
     def post(self, request):
-        # 判断用户是否登录
-        user = request.user
-        if not user.is_authenticated():
-            return JsonResponse({'res': 0, 'errmsg': '未登录'})
+        # 获取购物车所有者,未登录用户使用会话中的购物车,登录时合并到用户的购物车
+        owner = cart_owner(request, create=True)
 
         # 接收数据
         sku_id = request.POST.get('sku_id')
@@ -121,28 +101,21 @@ class UpdateCartView(View):
         except Exception as e:
             return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
 
-        # 检验商品是否存在
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except GoodsSKU.DoesNotExist:
-            return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
-
-        # 业务处理,redis 购物车商品数量更新
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
+        if count <= 0:
+            return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
 
-        # 更新 redis 的商品的数量
-        conn.hset(cart_key, sku_id, count)
+        # 业务处理,更新 redis 的商品的数量,数量超过库存时设置为库存数,同时更新并返回购物车商品总数
+        status, count, lines, total_count = update_cart(owner, sku_id, count)
 
-        # 将更新后的商品数量传递给模板
-        vals = conn.hvals(cart_key)
+        # 检验商品是否存在
+        if status == CART_NOT_EXIST:
+            return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
-        total_count = 0
-        for val in vals:
-            total_count += int(val)
+        if status == CART_NO_STOCK:
+            return JsonResponse({'res': 5, 'errmsg': '商品库存不足'})
 
         # 返回应答
-        return JsonResponse({'res': 4, 'total_count': total_count, 'errmsg': '更新成功'})
+        return JsonResponse({'res': 4, 'total_count': total_count, 'count': count, 'errmsg': '更新成功'})
 
 
 # /cart/delete
@@ -152,11 +125,9 @@ class DeleteCartView(View):
     请求方式: ajax post
     请求数据 sku_id
     """
-    # 判断用户是否登录
     def post(self, request):
-        user = request.user
-        if not user.is_authenticated():
-            return JsonResponse({'res': 0, 'errmsg': '未登录'})
+        # 获取购物车所有者,未登录用户使用会话中的购物车,登录时合并到用户的购物车
+        owner = cart_owner(request, create=True)
 
         # 接收数据
         sku_id = request.POST.get('sku_id')
@@ -165,25 +136,89 @@ class DeleteCartView(View):
         if not all([sku_id]):
             return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
 
-        # 检验商品是否存在
+        # 业务处理,删除 redis 里的购物车记录,同时更新并返回购物车商品总数
+        total_count = delete_cart(owner, sku_id)
+
+        # 返回应答
+        return JsonResponse({'res': 3, 'total_count': total_count, 'errmsg': '商品删除成功'})
+
+
+# /cart/batch
+class BatchCartView(View):
+    """
+    批量修改购物车,如再次购买订单中的商品、删除选中的商品
+    请求方式: ajax post
+    请求数据 items: json 列表,每项为 {"sku_id": 商品id, "count": 数量, "op": "add"/"update"/"delete"}
+    所有操作在 redis 中一次完成,商品的校验也在 redis 中完成,不需要查询数据库
+    """
+    def post(self, request):
+        # 获取购物车所有者,未登录用户使用会话中的购物车,登录时合并到用户的购物车
+        owner = cart_owner(request, create=True)
+
+        # 接收数据
+        items = request.POST.get('items')
+
+        # 校验数据
+        if not items:
+            return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+
         try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except GoodsSKU.DoesNotExist:
-            return JsonResponse({'res': 2, 'errmsg': '商品不存在'})
+            items = json.loads(items)
+        except ValueError:
+            return JsonResponse({'res': 1, 'errmsg': '数据格式错误'})
 
-        # 业务处理
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'res': 1, 'errmsg': '数据格式错误'})
 
-        # 删除 redis 里的购物车记录
-        conn.hdel(cart_key, sku_id)
+        if len(items) > settings.CART_BATCH_LIMIT:
+            return JsonResponse({'res': 1, 'errmsg': '商品数目过多'})
 
-        # 返回更新后的购物车总数目
+        # 检验每项操作是否合法,有一项不合法时不做任何修改
+        operations = []
+        for item in items:
+            try:
+                op = item.get('op')
+                sku_id = int(item.get('sku_id'))
+                count = int(item.get('count', 0))
+            except Exception as e:
+                return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
 
-        total_count = 0
+            if op not in CART_OPS:
+                return JsonResponse({'res': 1, 'errmsg': '操作不合法'})
 
-        for val in conn.hvals(cart_key):
-            total_count += int(val)
+            if op != 'delete' and count <= 0:
+                return JsonResponse({'res': 2, 'errmsg': '商品数目不合法'})
+
+            operations.append((sku_id, count, op))
+
+        # 业务处理,批量修改购物车,同时更新并返回购物车商品总数
+        results, lines, total_count = batch_cart(owner, operations)
+
+        # 每项操作的结果: res 0 成功, 1 商品不存在, 2 商品库存不足, count 为修改后的商品数量
+        items = [{'sku_id': sku_id, 'res': status, 'count': count}
+                 for (sku_id, _, _), (status, count) in zip(operations, results)]
 
         # 返回应答
-        return JsonResponse({'res': 3, 'total_count': total_count, 'errmsg': '商品删除成功'})
+        return JsonResponse({'res': 4, 'items': items, 'lines': lines, 'total_count': total_count, 'errmsg': '修改成功'})
+
+
+# /cart/count
+class CartCountView(View):
+    """
+    购物车数目,供 Nginx 直接返回的静态页面通过 ajax 获取
+    同时设置 csrftoken cookie,静态页面中没有 csrf token,ajax post 请求从 cookie 中读取
+    """
+    @method_decorator(ensure_csrf_cookie)
+    def dispatch(self, request, *args, **kwargs):
+        return super(CartCountView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        owner = cart_owner(request)
+        if owner is None:
+            return JsonResponse({'res': 0, 'count': 0})
+
+        # 获取购物车条目数,同时刷新购物车的过期时间
+        pl = get_redis_connection('default').pipeline(transaction=False)
+        pl.hlen(cart_key(owner))
+        touch_cart(pl, owner)
+        return JsonResponse({'res': 0, 'count': pl.execute()[0]})
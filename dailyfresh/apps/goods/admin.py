@@ -1,6 +1,5 @@
 from django.contrib import admin
-from celery_tasks.tasks import generate_static_index
-from django.core.cache import cache
+from celery_tasks.tasks import schedule_static_index, schedule_static_pages
 from goods.models import GoodsSKU, Goods, GoodsType, IndexTypeGoodsBanner, IndexGoodsBanner, IndexPromotionBanner
 
 
@@ -12,20 +11,20 @@ class BaseModelAdmin(admin.ModelAdmin):
 
         # 修改完之后,发出任务,在 Nginx 上重新生成 index.html
         # 使用 celery 异步生成 index.html,可以防止管理员在后台等待刷新
+        # 批量修改时经过防抖处理,只会生成一次
+        schedule_static_index()
+        # 同时增量生成详情页、列表页的静态页面
+        schedule_static_pages()
 
-        generate_static_index.delay()
-
-        # 更改之后,删除缓存,防止用户访问的一直是之前缓存过的内容,而不是新的内容
-        cache.delete('index_cache_data')
+        # 首页缓存由 goods.signals 根据修改的数据,使对应的片段失效
 
     def delete_model(self, request, obj):
         # 删除数据
         # 由于 admin 管理界面,存在这批量删除操作,因此 delete_model 函数是不会被调用的,而是会调用性能更加高的 query_set() 函数,
         super().delete_model(request, obj)
 
-        generate_static_index.delay()
-
-        cache.delete('sindex_cache_data')
+        schedule_static_index()
+        schedule_static_pages()
 
 
 class GoodsTypeAdmin(BaseModelAdmin):
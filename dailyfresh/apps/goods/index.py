@@ -0,0 +1,165 @@
+from django.core.cache import cache
+from utils.cache import incr_version
+from utils.local_cache import local_cache
+from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+
+
+# 首页片段缓存
+# 首页被拆分为 4 类片段: 商品种类菜单(types), 轮播图(banner), 促销活动(promotion), 每个种类的商品楼层(floor_typeid)
+# 每个片段单独缓存,并各自拥有一个版本号,缓存的键为 index_片段名_版本号
+# 后台修改数据时,只需将受影响片段的版本号 + 1,旧版本的缓存自然失效,其他片段的缓存不受影响
+# 片段内只保存已经取出的字典数据,而不是惰性的 QuerySet,避免每次读取缓存时再去查询数据库
+
+# 片段缓存的过期时间
+INDEX_CACHE_TIMEOUT = 3600
+
+
+def floor_fragment(type_id):
+    """商品楼层片段名"""
+    return 'floor_%d' % type_id
+
+
+def _version_key(fragment):
+    return 'index_version_%s' % fragment
+
+
+def _data_key(fragment, version):
+    return 'index_%s_%s' % (fragment, version)
+
+
+def bump_fragment(*fragments):
+    """片段版本号 + 1,使片段缓存失效"""
+    for fragment in fragments:
+        incr_version(_version_key(fragment))
+
+
+def get_fragments(fragments, builder):
+    """
+    批量获取首页片段
+    fragments: 片段名列表
+    builder: 生成片段数据的函数,接收缓存未命中的片段名列表,返回 {片段名: 片段数据}
+    版本号和片段数据各使用一次 get_many 获取,缓存未命中的片段交给 builder 一次性生成
+    """
+    version_keys = {fragment: _version_key(fragment) for fragment in fragments}
+    versions = cache.get_many(list(version_keys.values()))
+
+    data_keys = {fragment: _data_key(fragment, versions.get(key, 0)) for fragment, key in version_keys.items()}
+    cached = cache.get_many(list(data_keys.values()))
+
+    result = {}
+    missing = []
+    for fragment, key in data_keys.items():
+        if key in cached:
+            result[fragment] = cached[key]
+        else:
+            missing.append(fragment)
+
+    if missing:
+        built = builder(missing)
+        result.update(built)
+        cache.set_many({data_keys[fragment]: data for fragment, data in built.items()}, INDEX_CACHE_TIMEOUT)
+
+    return result
+
+
+def build_types():
+    """商品种类菜单"""
+    return [{'id': goods_type.id,
+             'name': goods_type.name,
+             'logo': goods_type.logo,
+             'image_url': goods_type.image.url} for goods_type in GoodsType.objects.all()]
+
+
+def build_banner():
+    """首页轮播图"""
+    return [{'sku_id': banner.sku_id,
+             'image_url': banner.image.url} for banner in IndexGoodsBanner.objects.all().order_by('index')]
+
+
+def build_promotion():
+    """首页促销活动"""
+    return [{'url': ad.url,
+             'image_url': ad.image.url} for ad in IndexPromotionBanner.objects.all().order_by('index')]
+
+
+def build_floors(type_ids):
+    """
+    商品楼层,每个种类分为文字展示和图片展示两部分
+    所有种类的楼层商品通过一次联表查询取出,再在内存中按种类和展示类型分组,
+    查询次数不会随着种类的增加而增加
+    """
+    floors = {type_id: {'title_banners': [], 'image_banners': []} for type_id in type_ids}
+
+    banners = IndexTypeGoodsBanner.objects.filter(type_id__in=type_ids).select_related('sku').order_by('index')
+    for banner in banners:
+        item = {'sku_id': banner.sku.id,
+                'sku_name': banner.sku.name,
+                'sku_image_url': banner.sku.image.url,
+                'sku_price': banner.sku.price}
+        if banner.display_type == 0:
+            floors[banner.type_id]['title_banners'].append(item)
+        else:
+            floors[banner.type_id]['image_banners'].append(item)
+
+    return floors
+
+
+# 非楼层片段的生成函数
+BUILDERS = {'types': build_types,
+            'banner': build_banner,
+            'promotion': build_promotion}
+
+
+def _build_fragments(fragments):
+    return {fragment: BUILDERS[fragment]() for fragment in fragments}
+
+
+def _build_floor_fragments(fragments):
+    type_ids = [int(fragment[len('floor_'):]) for fragment in fragments]
+    floors = build_floors(type_ids)
+    return {floor_fragment(type_id): floor for type_id, floor in floors.items()}
+
+
+def get_goods_types():
+    """
+    商品种类菜单,首页、详情页、列表页共用同一个缓存片段
+    种类几乎不变,额外缓存在进程内存中,大部分请求不需要访问 redis 和数据库
+    """
+    return local_cache.get('goods_types', lambda: get_fragments(['types'], _build_fragments)['types'])
+
+
+def get_goods_type(type_id):
+    """根据 id 获取单个商品种类,不存在时返回 None"""
+    for goods_type in get_goods_types():
+        if goods_type['id'] == type_id:
+            return goods_type
+    return None
+
+
+def get_index_data(use_cache=True):
+    """
+    首页数据组装,首页视图和首页静态页面生成任务共用
+    use_cache: 是否使用片段缓存,生成静态页面时直接读取数据库中的最新数据
+    数据库查询次数固定: 种类、轮播图、促销活动、楼层各一次
+    """
+    if use_cache:
+        fragments = get_fragments(list(BUILDERS), _build_fragments)
+    else:
+        fragments = _build_fragments(BUILDERS)
+
+    # 根据种类菜单,获取每个种类的商品楼层
+    type_ids = [goods_type['id'] for goods_type in fragments['types']]
+    if use_cache:
+        floors = get_fragments([floor_fragment(type_id) for type_id in type_ids], _build_floor_fragments)
+    else:
+        floors = {floor_fragment(type_id): floor for type_id, floor in build_floors(type_ids).items()}
+
+    goods_types = []
+    for goods_type in fragments['types']:
+        # 不直接修改缓存取出的字典,拼接出带楼层数据的新字典
+        goods_type = dict(goods_type, **floors[floor_fragment(goods_type['id'])])
+        goods_types.append(goods_type)
+
+    return {'goods_types': goods_types,
+            'goods_banner': fragments['banner'],
+            'ad_banner': fragments['promotion']}
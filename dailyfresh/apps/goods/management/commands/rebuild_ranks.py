@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from goods.ranking import rebuild_ranks
+
+
+class Command(BaseCommand):
+    """全量重建商品种类的价格、销量排行"""
+    help = '重建 redis 中各商品种类的价格、销量排行'
+
+    def handle(self, *args, **options):
+        count = rebuild_ranks()
+        self.stdout.write('已重建 %d 个排行' % count)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from goods.stock import rebuild_sku_stock
+
+
+class Command(BaseCommand):
+    """全量重建 redis 中的在售商品库存"""
+    help = '重建 redis 中的在售商品库存,购物车使用它校验商品和限制数量'
+
+    def handle(self, *args, **options):
+        count = rebuild_sku_stock()
+        self.stdout.write('已同步 %d 个商品的库存' % count)
@@ -45,6 +45,8 @@ class GoodsSKU(BaseModel):
         db_table = 'df_goods_sku'
         verbose_name = '商品'
         verbose_name_plural = verbose_name
+        # 列表页按 种类 + 价格/销量 排序分页
+        index_together = [('type', 'price'), ('type', 'sales')]
 
 
 class Goods(BaseModel):
@@ -0,0 +1,299 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import base64
+from utils.cache import incr_version, get_or_build
+from goods.models import GoodsSKU
+from goods.index import get_goods_types
+from goods.ranking import RANK_SORTS, get_rank_page
+from goods.stock import get_sku_stock
+from order.models import OrderGoods
+
+
+# 详情页、列表页中与用户无关的上下文数据
+# 商品视图和静态页面生成任务共用,购物车等与用户相关的数据由视图自己添加
+
+# 列表页的排序方式
+LIST_SORTS = ('default', 'price', 'sales')
+
+# 商品详情缓存的逻辑过期时间
+DETAIL_CACHE_TIMEOUT = 600
+
+# 种类商品总数缓存时间
+LIST_COUNT_TIMEOUT = 600
+
+# 每页评论数目
+COMMENT_PAGE_SIZE = 10
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def detail_version_key(sku_id):
+    return 'detail_version_%d' % sku_id
+
+
+def bump_detail(*sku_ids):
+    """详情页缓存版本号 + 1,使商品详情缓存失效"""
+    for sku_id in sku_ids:
+        incr_version(detail_version_key(sku_id))
+
+
+def _encode_cursor(*parts):
+    """分页游标: 将上一页最后一条记录的位置拼接后使用 base64 编码,不对外暴露数据格式"""
+    cursor = '_'.join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def _decode_cursor(cursor, size):
+    """解析分页游标,游标不合法时抛出 ValueError"""
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split('_')
+    except Exception as e:
+        raise ValueError('游标不合法')
+
+    if len(parts) != size:
+        raise ValueError('游标不合法')
+
+    return parts
+
+
+def _microseconds(time):
+    delta = time - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def get_comments(sku_id, cursor=None):
+    """
+    商品评论,按创建时间倒序,每次取一页
+    使用游标分页(create_time, id),配合 (sku, create_time) 联合索引,翻到任何一页都只扫描一页的数据
+    返回 (评论列表, 下一页游标),没有下一页时游标为 None
+    """
+    orders = OrderGoods.objects.filter(sku_id=sku_id).exclude(comment='')
+
+    if cursor:
+        microseconds, order_goods_id = _decode_cursor(cursor, 2)
+        try:
+            create_time = EPOCH + timedelta(microseconds=int(microseconds))
+            order_goods_id = int(order_goods_id)
+        except (ValueError, OverflowError):
+            # 伪造的游标时间超出 datetime 范围时抛出 OverflowError
+            raise ValueError('游标不合法')
+        orders = orders.filter(Q(create_time__lt=create_time) | Q(create_time=create_time, id__lt=order_goods_id))
+
+    # 多取一条,用来判断是否还有下一页
+    orders = list(orders.select_related('order__user').order_by('-create_time', '-id')[:COMMENT_PAGE_SIZE + 1])
+
+    next_cursor = None
+    if len(orders) > COMMENT_PAGE_SIZE:
+        orders = orders[:COMMENT_PAGE_SIZE]
+        next_cursor = _encode_cursor(_microseconds(orders[-1].create_time), orders[-1].id)
+
+    comments = [{'update_time': order.update_time,
+                 'username': order.order.user.username,
+                 'comment': order.comment} for order in orders]
+
+    return comments, next_cursor
+
+
+def build_detail(sku_id):
+    """
+    单个商品详情页数据,只保存模板需要的字段
+    商品不存在时抛出 GoodsSKU.DoesNotExist
+    """
+    # 获取商品信息,同时取出商品种类和商品 SPU
+    sku = GoodsSKU.objects.select_related('type', 'goods').get(id=sku_id)
+
+    # 获取商品评论,详情页只展示第一页评论和评论总数,其余评论通过评论接口分页获取
+    comments, next_cursor = get_comments(sku_id)
+    comment_count = OrderGoods.objects.filter(sku_id=sku_id).exclude(comment='').count()
+
+    # 获取新品推荐信息,每次只显示两个新品,由创建时间来确定是否是新品
+    new_goods_recommend = GoodsSKU.objects.filter(type_id=sku.type_id).order_by('-create_time').exclude(id=sku_id)[:2]  # exclude 返回不包括传入参数的内容,order_by('-count') 按照 count 倒叙的方式排列
+
+    # 同一 SPU 下的其他规格商品
+    same_spu_skus = GoodsSKU.objects.filter(goods_id=sku.goods_id).exclude(id=sku_id)
+
+    return {'sku': {'id': sku.id,
+                    'name': sku.name,
+                    'desc': sku.desc,
+                    'price': sku.price,
+                    'unite': sku.unite,
+                    'stock': sku.stock,
+                    'image_url': sku.image.url,
+                    'type_id': sku.type_id,
+                    'type_name': sku.type.name,
+                    'goods_detail': sku.goods.detail},
+            'comments': comments,
+            'comments_cursor': next_cursor,
+            'comment_count': comment_count,
+            'new_goods_recommend': [{'id': new_goods.id,
+                                     'name': new_goods.name,
+                                     'price': new_goods.price,
+                                     'image_url': new_goods.image.url} for new_goods in new_goods_recommend],
+            'same_spu_skus': [{'id': same_sku.id,
+                               'name': same_sku.name} for same_sku in same_spu_skus],
+            }
+
+
+def get_detail_context(sku_id, use_cache=True):
+    """
+    详情页上下文
+    商品详情按 商品 id + 版本号 缓存,缓存过期后只有一个进程重建缓存,其他进程返回旧数据,防止热门商品击穿数据库
+    下单、取消订单通过批量 update 修改库存,不会使缓存失效,库存从 redis 在售商品库存中实时读取
+    use_cache: 是否使用缓存,生成静态页面时直接读取数据库中的最新数据
+    """
+    if use_cache:
+        version = cache.get(detail_version_key(sku_id), 0)
+        detail = get_or_build('detail_%d_%s' % (sku_id, version),
+                              lambda: build_detail(sku_id),
+                              DETAIL_CACHE_TIMEOUT)
+        stock = get_sku_stock(sku_id)
+        if stock is not None:
+            detail = dict(detail, sku=dict(detail['sku'], stock=stock))
+    else:
+        detail = build_detail(sku_id)
+
+    return dict(detail, goods_types=get_goods_types())
+
+
+def get_list_count(type_id):
+    """种类下的商品总数,用于计算页码,缓存后不必每次翻页都执行 COUNT(*)"""
+    key = 'list_count_%d' % type_id
+    count = cache.get(key)
+    if count is None:
+        count = GoodsSKU.objects.filter(type_id=type_id).count()
+        cache.set(key, count, LIST_COUNT_TIMEOUT)
+    return count
+
+
+def _list_position(sort, cursor):
+    """
+    根据游标生成查询条件,从上一页最后一个商品之后开始取数据(keyset 分页),
+    不需要 OFFSET 扫描前面的数据,翻到任何一页的代价都与第一页相同
+    排序字段相同时按 id 排序,保证顺序唯一
+    """
+    cursor_sort, value, sku_id = _decode_cursor(cursor, 3)
+    if cursor_sort != sort:
+        raise ValueError('游标不合法')
+
+    try:
+        sku_id = int(sku_id)
+        if sort == 'price':
+            price = Decimal(value)
+            # Decimal 能解析 NaN、Infinity,不是合法的价格
+            if not price.is_finite():
+                raise ValueError('游标不合法')
+            return Q(price__gt=price) | Q(price=price, id__gt=sku_id)
+        elif sort == 'sales':
+            sales = int(value)
+            return Q(sales__lt=sales) | Q(sales=sales, id__gt=sku_id)
+        else:
+            return Q(id__lt=sku_id)
+    except (ValueError, InvalidOperation):
+        raise ValueError('游标不合法')
+
+
+def _list_cursor(sort, sku):
+    if sort == 'price':
+        return _encode_cursor(sort, sku.price, sku.id)
+    elif sort == 'sales':
+        return _encode_cursor(sort, sku.sales, sku.id)
+    else:
+        return _encode_cursor(sort, '', sku.id)
+
+
+def get_list_context(goods_type, page, sort, cursor=None):
+    """
+    列表页上下文
+    goods_type: 商品种类字典,由 get_goods_type 获取
+    cursor: 点击下一页时传递的游标,有游标时使用 keyset 分页,否则按页码跳转
+    """
+    # 获取所有商品种类
+    goods_types = get_goods_types()
+
+    type_id = goods_type['id']
+
+    # 获取商品新品推荐
+    new_goods_commend = GoodsSKU.objects.filter(type_id=type_id).order_by('-create_time')[:2]
+
+    # 获取一个种类下的所有商品信息,并将商品根据地址栏获取的排序方式进行排序
+    # 三种排序方式,default,price,sales
+    if sort == 'price':
+        goods_list = GoodsSKU.objects.filter(type_id=type_id).order_by('price', 'id')
+    elif sort == 'sales':
+        goods_list = GoodsSKU.objects.filter(type_id=type_id).order_by('-sales', 'id')
+    else:
+        sort = 'default'
+        goods_list = GoodsSKU.objects.filter(type_id=type_id).order_by('-id')
+
+    page_size = settings.LIST_PAGE_SIZE
+
+    # 获取页码总数,商品总数从缓存中读取
+    page_numbers = max(1, (get_list_count(type_id) + page_size - 1) // page_size)
+
+    # 由于地址栏获取的数据都是字符串形式,当用户输入的 page 是无效值时,默认返回第一页内容
+    try:
+        page = int(page)
+        # 当 用户输入的页码超过总页码时,返回第一页内容
+        if page > page_numbers or page < 1:
+            page = 1
+    except Exception as e:
+        page = 1
+
+    start = (page - 1) * page_size
+
+    # 按价格、销量排序时,优先从 redis 排行中按名次取出一页商品 id,再使用 in_bulk 一次查询出商品
+    # 多取一个商品,用来判断是否还有下一页
+    sku_ids = None
+    if sort in RANK_SORTS:
+        sku_ids = get_rank_page(sort, type_id, start, page_size + 1)
+
+    if sku_ids is not None:
+        skus = GoodsSKU.objects.filter(type_id=type_id).in_bulk(sku_ids)
+        # 按排行中的顺序排列,排行中已不属于该种类的商品会被过滤掉
+        goods_page = [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
+        has_next = len(sku_ids) > page_size
+        goods_page = goods_page[:page_size]
+        next_cursor = ''
+    else:
+        # 有合法游标时从游标位置开始取数据,否则按页码偏移
+        if cursor:
+            try:
+                goods_list = goods_list.filter(_list_position(sort, cursor))
+                start = 0
+            except ValueError:
+                pass
+
+        goods_page = list(goods_list[start:start + page_size + 1])
+        has_next = len(goods_page) > page_size
+        goods_page = goods_page[:page_size]
+
+        next_cursor = _list_cursor(sort, goods_page[-1]) if has_next else ''
+
+    # 页码控制,设置显示 5 条页码
+    # 1. 当所有页 pages_number < 5 时,显示所有页码
+    # 2. 当前页 page 是前三页时,显示 1, page, 3, 4, 5
+    # 3. 当前页 page 是最后三页时,显示 page - 2, page -1, page, page + 1, pages_number + 1
+    # 4. 其他情况下,显示 page - 2, pgae -1, page, page + 1, page + 2
+    if page_numbers < 5:
+        pages = range(1, page_numbers+1)
+    elif page < 3:
+        pages = range(1, 6)
+    elif page_numbers - page < 2:
+        pages = range(page-2, page_numbers+1)
+    else:
+        pages = range(page-2, page+3)
+
+    return {'goods_types': goods_types,
+            'types': goods_type,
+            'new_goods_commend': new_goods_commend,
+            'goods_page': goods_page,
+            'page': page,
+            'has_previous': page > 1,
+            'has_next': has_next,
+            'next_cursor': next_cursor,
+            'sort': sort,
+            'pages': pages}
@@ -0,0 +1,117 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+
+
+# 商品排行
+# 每个种类在 redis 里维护两个有序集合: rank_price_typeid (按价格), rank_sales_typeid (按销量),成员为 sku_id
+# 列表页按价格、销量排序时,直接使用 zrange 按名次取出一页商品 id,不必每次都在 mysql 里排序
+# 商品修改、下单时增量更新有序集合,数据出现偏差时使用 python manage.py rebuild_ranks 全量重建
+# 增量更新只修改已经存在的有序集合,排行不存在(尚未重建或被淘汰)时不会只写入部分商品,列表页回退到数据库查询
+
+# 使用有序集合排序的方式: (字段名, 是否倒序)
+RANK_SORTS = {'price': ('price', False),
+              'sales': ('sales', True)}
+
+
+# 只更新已经存在的排行
+# KEYS[i]: 排行, ARGV[1]: 命令 ZADD 或 ZINCRBY, ARGV[2i]: 成员, ARGV[2i + 1]: 分数或增量
+UPDATE_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call(ARGV[1], KEYS[i], ARGV[2 * i + 1], ARGV[2 * i])
+    end
+end
+"""
+
+
+def rank_key(sort, type_id):
+    return 'rank_%s_%d' % (sort, type_id)
+
+
+def _update_ranks(command, updates):
+    """
+    使用一次 lua 脚本更新多个排行
+    updates: [(排行, 成员, 分数), ...]
+    """
+    if not updates:
+        return
+    conn = get_redis_connection('default')
+    keys = [key for key, member, score in updates]
+    args = [command]
+    for key, member, score in updates:
+        args.extend([member, score])
+    conn.register_script(UPDATE_SCRIPT)(keys=keys, args=args)
+
+
+def update_sku_rank(sku, old_type_id=None):
+    """
+    商品保存后,更新商品在所属种类中的价格、销量分数
+    old_type_id: 修改前的种类,种类发生变化时从原种类的排行中移除
+    """
+    if old_type_id is not None and old_type_id != sku.type_id:
+        _remove_rank(sku.id, old_type_id)
+    _update_ranks('ZADD', [(rank_key(sort, sku.type_id), sku.id, float(getattr(sku, field)))
+                           for sort, (field, reverse) in RANK_SORTS.items()])
+
+
+def _remove_rank(sku_id, type_id):
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    for sort in RANK_SORTS:
+        pl.zrem(rank_key(sort, type_id), sku_id)
+    pl.execute()
+
+
+def remove_sku_rank(sku):
+    """商品删除后,从所属种类的排行中移除"""
+    _remove_rank(sku.id, sku.type_id)
+
+
+def incr_sales_rank(sales):
+    """
+    下单后增加商品销量分数
+    sales: [(type_id, sku_id, 销量增量), ...],使用一次 lua 脚本完成
+    """
+    _update_ranks('ZINCRBY', [(rank_key('sales', type_id), sku_id, count) for type_id, sku_id, count in sales])
+
+
+def get_rank_page(sort, type_id, start, count):
+    """
+    按名次获取一页商品 id,复杂度 O(log n + count)
+    排行尚未生成时返回 None,由调用者回退到数据库查询
+    """
+    conn = get_redis_connection('default')
+    key = rank_key(sort, type_id)
+    reverse = RANK_SORTS[sort][1]
+
+    pl = conn.pipeline()
+    pl.exists(key)
+    if reverse:
+        pl.zrevrange(key, start, start + count - 1)
+    else:
+        pl.zrange(key, start, start + count - 1)
+    exists, sku_ids = pl.execute()
+
+    if not exists:
+        return None
+    return [int(sku_id) for sku_id in sku_ids]
+
+
+def rebuild_ranks():
+    """全量重建所有种类的排行,先写入临时键,再通过 rename 原子替换"""
+    ranks = {}
+    for sku_id, type_id, price, sales in GoodsSKU.objects.values_list('id', 'type_id', 'price', 'sales'):
+        row = {'price': price, 'sales': sales}
+        for sort, (field, reverse) in RANK_SORTS.items():
+            ranks.setdefault(rank_key(sort, type_id), {})[sku_id] = float(row[field])
+
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    for key, scores in ranks.items():
+        tmp_key = '%s_tmp' % key
+        pl.delete(tmp_key)
+        pl.zadd(tmp_key, scores)
+        pl.rename(tmp_key, key)
+    pl.execute()
+
+    return len(ranks)
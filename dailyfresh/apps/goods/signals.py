@@ -0,0 +1,151 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.core.cache import cache
+from utils.local_cache import local_cache
+from utils.middleware import repeat_after_commit
+
+from goods.models import GoodsType, GoodsSKU, Goods, GoodsImage, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from goods.index import bump_fragment, floor_fragment
+from goods.pages import bump_detail
+from goods.ranking import update_sku_rank, remove_sku_rank
+from goods.stock import update_sku_stock, remove_sku_stock
+from goods.static_pages import mark_static_dirty, mark_all_static_dirty, is_new_goods
+from order.models import OrderGoods
+from celery_tasks.tasks import schedule_static_pages
+
+
+# 后台数据发生变化时,只使对应的首页片段缓存失效
+# 批量删除时不会调用 ModelAdmin.delete_model,但每条记录仍会发出 post_delete 信号,因此使用信号而不是在 admin 里处理
+# admin 在事务中修改数据,缓存失效操作通过 repeat_after_commit 在事务提交后再执行一次
+
+@receiver([post_save, post_delete], sender=GoodsType)
+def goods_type_changed(sender, instance, **kwargs):
+    # 种类名称、图片同时出现在菜单和楼层中
+    repeat_after_commit(bump_fragment, 'types', floor_fragment(instance.id))
+    # 通知所有进程删除进程内缓存的种类菜单
+    repeat_after_commit(local_cache.invalidate, 'goods_types')
+
+
+@receiver([post_save, post_delete], sender=IndexGoodsBanner)
+def goods_banner_changed(sender, instance, **kwargs):
+    repeat_after_commit(bump_fragment, 'banner')
+
+
+@receiver([post_save, post_delete], sender=IndexPromotionBanner)
+def promotion_banner_changed(sender, instance, **kwargs):
+    repeat_after_commit(bump_fragment, 'promotion')
+
+
+@receiver([post_save, post_delete], sender=IndexTypeGoodsBanner)
+def type_goods_banner_changed(sender, instance, **kwargs):
+    repeat_after_commit(bump_fragment, floor_fragment(instance.type_id))
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def goods_sku_count_changed(sender, instance, **kwargs):
+    # 种类商品总数缓存失效,列表页页码重新计算
+    repeat_after_commit(cache.delete, 'list_count_%d' % instance.type_id)
+
+
+@receiver(pre_save, sender=GoodsSKU)
+def goods_sku_type_loaded(sender, instance, **kwargs):
+    # 记录修改前的种类,种类发生变化时从原种类的排行中移除
+    instance._old_type_id = None
+    if instance.id:
+        instance._old_type_id = GoodsSKU.objects.filter(id=instance.id).values_list('type_id', flat=True).first()
+
+
+@receiver(post_save, sender=GoodsSKU)
+def goods_sku_rank_saved(sender, instance, **kwargs):
+    # 更新种类排行中的价格、销量
+    update_sku_rank(instance, getattr(instance, '_old_type_id', None))
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def goods_sku_rank_deleted(sender, instance, **kwargs):
+    remove_sku_rank(instance)
+
+
+@receiver(post_save, sender=GoodsSKU)
+def goods_sku_stock_saved(sender, instance, **kwargs):
+    # 同步购物车使用的在售商品库存
+    update_sku_stock(instance)
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def goods_sku_stock_deleted(sender, instance, **kwargs):
+    remove_sku_stock(instance.id)
+
+
+@receiver(post_save, sender=GoodsSKU)
+def goods_sku_changed(sender, instance, **kwargs):
+    # 商品名称、图片、价格会在所属楼层中展示,删除商品时会级联删除楼层记录,由楼层记录的信号处理
+    type_ids = set(IndexTypeGoodsBanner.objects.filter(sku_id=instance.id).values_list('type_id', flat=True))
+    repeat_after_commit(bump_fragment, *[floor_fragment(type_id) for type_id in type_ids])
+
+
+# 商品详情缓存失效
+# 同一 SPU 下的商品会互相展示为其他规格,因此一起失效;新品推荐允许在缓存过期前展示旧数据
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def goods_sku_detail_changed(sender, instance, **kwargs):
+    sku_ids = list(GoodsSKU.objects.filter(goods_id=instance.goods_id).values_list('id', flat=True))
+    repeat_after_commit(bump_detail, instance.id, *sku_ids)
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_detail_changed(sender, instance, **kwargs):
+    repeat_after_commit(bump_detail, *GoodsSKU.objects.filter(goods_id=instance.id).values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=GoodsImage)
+def goods_image_changed(sender, instance, **kwargs):
+    repeat_after_commit(bump_detail, instance.sku_id)
+    schedule_static_pages()
+
+
+@receiver(post_save, sender=OrderGoods)
+def order_goods_commented(sender, instance, **kwargs):
+    # 详情页缓存中包含第一页评论和评论总数,提交订单时评论为空,不需要失效
+    if instance.comment:
+        repeat_after_commit(bump_detail, instance.sku_id)
+        # 静态详情页中的评论同样需要更新
+        schedule_static_pages()
+
+
+# 静态页面
+# 标记受影响的详情页、列表页,由 celery 任务只重新生成这些页面
+
+@receiver([post_save, post_delete], sender=GoodsType)
+def goods_type_static_changed(sender, instance, **kwargs):
+    # 种类菜单出现在所有页面中
+    mark_all_static_dirty()
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def goods_sku_static_changed(sender, instance, **kwargs):
+    # 同一 SPU 的其他规格展示商品名称;商品在新品推荐中展示时,整个种类的详情页都受影响
+    if is_new_goods(instance):
+        sku_ids = GoodsSKU.objects.filter(type_id=instance.type_id).values_list('id', flat=True)
+    else:
+        sku_ids = GoodsSKU.objects.filter(goods_id=instance.goods_id).values_list('id', flat=True)
+    type_ids = {instance.type_id}
+    if getattr(instance, '_old_type_id', None) is not None:
+        type_ids.add(instance._old_type_id)
+    mark_static_dirty([instance.id] + list(sku_ids), type_ids)
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_static_changed(sender, instance, **kwargs):
+    mark_static_dirty(GoodsSKU.objects.filter(goods_id=instance.id).values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=GoodsImage)
+def goods_image_static_changed(sender, instance, **kwargs):
+    mark_static_dirty([instance.sku_id])
+
+
+@receiver(post_save, sender=OrderGoods)
+def order_goods_static_commented(sender, instance, **kwargs):
+    if instance.comment:
+        mark_static_dirty([instance.sku_id])
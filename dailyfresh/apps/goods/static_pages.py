@@ -0,0 +1,59 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsType, GoodsSKU
+
+
+# 详情页、列表页静态页面的增量生成
+# 数据发生变化时(后台修改、下单扣减库存、评论、商品图片),将受影响的详情页 sku_id、列表页 type_id
+# 加入 redis 集合 static_detail_dirty、static_list_dirty,
+# 生成任务每次只取出集合中的页面重新生成,不扫描商品表、订单商品表
+
+# 需要重新生成的详情页(sku_id)、列表页(type_id)
+STATIC_DETAIL_DIRTY = 'static_detail_dirty'
+STATIC_LIST_DIRTY = 'static_list_dirty'
+
+# 新品推荐展示同种类最新的两个商品(不含自己),种类最新的三个商品发生变化时,整个种类的详情页都需要重新生成
+NEW_GOODS_SIZE = 3
+
+
+def mark_static_dirty(sku_ids=(), type_ids=()):
+    """标记需要重新生成的详情页和列表页"""
+    sku_ids = list(sku_ids)
+    type_ids = list(type_ids)
+    if not sku_ids and not type_ids:
+        return
+
+    conn = get_redis_connection('default')
+    pl = conn.pipeline(transaction=False)
+    if sku_ids:
+        pl.sadd(STATIC_DETAIL_DIRTY, *sku_ids)
+    if type_ids:
+        pl.sadd(STATIC_LIST_DIRTY, *type_ids)
+    pl.execute()
+
+
+def mark_all_static_dirty():
+    """所有页面都需要重新生成,用于种类菜单发生变化和第一次生成"""
+    mark_static_dirty(GoodsSKU.objects.values_list('id', flat=True),
+                      GoodsType.objects.values_list('id', flat=True))
+
+
+def is_new_goods(sku):
+    """商品是否在所属种类的新品推荐中展示,商品已被删除时判断删除前是否展示"""
+    times = list(GoodsSKU.objects.filter(type_id=sku.type_id).order_by('-create_time')
+                 .values_list('create_time', flat=True)[:NEW_GOODS_SIZE])
+    return len(times) < NEW_GOODS_SIZE or sku.create_time >= times[-1]
+
+
+def pop_static_dirty():
+    """
+    取出并清空需要重新生成的页面,在一个事务中完成,取出期间新标记的页面留到下一次生成
+    返回 (sku_id 列表, type_id 列表)
+    """
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    pl.smembers(STATIC_DETAIL_DIRTY)
+    pl.delete(STATIC_DETAIL_DIRTY)
+    pl.smembers(STATIC_LIST_DIRTY)
+    pl.delete(STATIC_LIST_DIRTY)
+    sku_ids, _, type_ids, _ = pl.execute()
+    return sorted(int(sku_id) for sku_id in sku_ids), sorted(int(type_id) for type_id in type_ids)
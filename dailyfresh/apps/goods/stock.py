@@ -0,0 +1,82 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+import time
+
+
+# 在售商品库存
+# redis hash sku_stock: sku_id 为属性,库存为值,只保存未删除的商品
+# 购物车通过它校验商品是否存在并限制购买数量,修改购物车时不需要查询数据库
+# 商品保存、删除时同步更新,数据出现偏差时使用 python manage.py rebuild_sku_stock 全量重建
+# 部署后、redis 清空后该 hash 不存在,购物车第一次修改时通过 ensure_sku_stock 自动重建
+SKU_STOCK_KEY = 'sku_stock'
+
+
+def update_sku_stock(sku):
+    """商品保存后同步库存,被标记删除的商品移出"""
+    conn = get_redis_connection('default')
+    if sku.is_delete:
+        conn.hdel(SKU_STOCK_KEY, sku.id)
+    else:
+        conn.hset(SKU_STOCK_KEY, sku.id, sku.stock)
+
+
+def remove_sku_stock(sku_id):
+    conn = get_redis_connection('default')
+    conn.hdel(SKU_STOCK_KEY, sku_id)
+
+
+def get_sku_stock(sku_id):
+    """读取商品的实时库存,hash 中不存在时返回 None"""
+    conn = get_redis_connection('default')
+    stock = conn.hget(SKU_STOCK_KEY, sku_id)
+    return None if stock is None else int(stock)
+
+
+def set_skus_stock(stocks):
+    """
+    批量同步库存,用于不会发出 post_save 信号的批量 update
+    stocks: {sku_id: 库存}
+    """
+    if stocks:
+        conn = get_redis_connection('default')
+        conn.hmset(SKU_STOCK_KEY, stocks)
+
+
+def rebuild_sku_stock():
+    """全量重建在售商品库存,先写入临时键,再通过 rename 原子替换"""
+    stocks = dict(GoodsSKU.objects.filter(is_delete=False).values_list('id', 'stock'))
+
+    conn = get_redis_connection('default')
+    tmp_key = '%s_tmp' % SKU_STOCK_KEY
+    pl = conn.pipeline()
+    pl.delete(tmp_key)
+    if stocks:
+        pl.hmset(tmp_key, stocks)
+        pl.rename(tmp_key, SKU_STOCK_KEY)
+    else:
+        pl.delete(SKU_STOCK_KEY)
+    pl.execute()
+
+    return len(stocks)
+
+
+def ensure_sku_stock():
+    """
+    在售商品库存不存在时重建
+    多个进程同时发现时只有抢到锁的进程重建,其他进程等待重建完成
+    """
+    conn = get_redis_connection('default')
+    if conn.exists(SKU_STOCK_KEY):
+        return
+
+    if conn.set('sku_stock_lock', 1, nx=True, ex=60):
+        try:
+            rebuild_sku_stock()
+        finally:
+            conn.delete('sku_stock_lock')
+        return
+
+    for i in range(50):
+        time.sleep(0.1)
+        if conn.exists(SKU_STOCK_KEY):
+            return
@@ -1,3 +1,46 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from django.db.models import Q
+from decimal import Decimal
+from goods.pages import LIST_SORTS, _encode_cursor, _list_cursor, _list_position
 
 # Create your tests here.
+
+
+class Sku(object):
+    def __init__(self, id, price, sales):
+        self.id = id
+        self.price = price
+        self.sales = sales
+
+
+class ListCursorTest(SimpleTestCase):
+    """列表页游标分页"""
+
+    def setUp(self):
+        self.sku = Sku(7, Decimal('12.50'), 30)
+
+    def test_round_trip(self):
+        """每种排序方式生成的游标都能解析为从该商品之后开始的查询条件"""
+        expected = {'default': Q(id__lt=7),
+                    'price': Q(price__gt=Decimal('12.50')) | Q(price=Decimal('12.50'), id__gt=7),
+                    'sales': Q(sales__lt=30) | Q(sales=30, id__gt=7)}
+        for sort in LIST_SORTS:
+            position = _list_position(sort, _list_cursor(sort, self.sku))
+            self.assertEqual(str(position), str(expected[sort]))
+
+    def test_other_sort(self):
+        """游标只能用于生成它的排序方式"""
+        cursor = _list_cursor('price', self.sku)
+        for sort in ('default', 'sales'):
+            with self.assertRaises(ValueError):
+                _list_position(sort, cursor)
+
+    def test_invalid_price(self):
+        for value in ('NaN', 'sNaN', 'Infinity', '-Infinity', 'abc'):
+            with self.assertRaises(ValueError):
+                _list_position('price', _encode_cursor('price', value, 7))
+
+    def test_invalid_cursor(self):
+        for cursor in ('!!!', _encode_cursor('sales', 30), _encode_cursor('sales', 'x', 7)):
+            with self.assertRaises(ValueError):
+                _list_position('sales', cursor)
@@ -1,10 +1,11 @@
 from django.conf.urls import url
-from goods.views import IndexView, DetailView, ListView
+from goods.views import IndexView, DetailView, CommentView, ListView
 
 
 urlpatterns = [
     url(r'^index$', IndexView.as_view(), name='index'),  # 首页
     url(r'^detail/(?P<goods_id>\d+)$', DetailView.as_view(), name='detail'),  # 详情页
+    url(r'^detail/(?P<goods_id>\d+)/comments$', CommentView.as_view(), name='comments'),  # 商品评论分页
     url(r'^list/(?P<type_id>\d+)/(?P<page>\d+)$', ListView.as_view(), name='list'),  # 列表页
     # url(r'^list/(?P<type_id>\d+)/(?P<page>\d+)$', ListView.as_view(), name='list'),  # 列表页
 
@@ -0,0 +1,325 @@
+from django.conf import settings
+from django.db import transaction, OperationalError
+from django.db.models import F, Case, When, IntegerField
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from goods.ranking import incr_sales_rank
+from goods.stock import set_skus_stock
+from goods.static_pages import mark_static_dirty
+from order.models import OrderInfo, OrderGoods
+from order.flash import reserve_order, release_reservation, RESERVE_OK, RESERVE_NO_STOCK, RESERVE_MIXED
+from order.queue import enqueue_order
+from order.expiry import schedule_expiry, needs_payment
+from cart.utils import cart_key, delete_cart
+from utils.snowflake import snowflake
+import random
+import time
+
+
+# 订单提交
+# 一次 hmget 读取购物车中所有商品的数量(在事务外读取,不占用行锁的时间),
+# 再按 settings.ORDER_COMMIT_MODE 选择的方式在事务中扣减库存、添加订单,
+# 事务提交后,同步 redis 中的销量排行、在售商品库存,并删除购物车记录
+#
+# pessimistic(悲观锁): 整个订单只使用固定数目的语句,不随商品数目增加
+# 1. 一次 select ... for update 按 id 顺序锁定所有商品,不同订单总是以相同顺序加锁,不会互相死锁
+# 2. 一次 update 使用 F() 表达式扣减所有商品的库存、增加销量
+# 3. 一次 bulk_create 添加所有订单商品
+#
+# optimistic(乐观锁): 不预先加锁,也不先读库存再比较
+# 每个商品使用一条带条件的 update ... where stock >= count 扣减库存,受影响行数为 0 即库存不足,
+# 死锁、锁等待超时时按带随机抖动的指数退避重试整个事务,重试次数由 ORDER_COMMIT_RETRIES 限制
+#
+# 秒杀商品不使用以上方式,在 redis 中预留库存后由 celery 任务分批写入数据库,见 order/flash.py
+# settings.ORDER_COMMIT_QUEUED 为 True 时,普通订单也只放入订单队列,立即返回,由 celery 任务分批写入数据库,
+# 一批订单中的每个商品只上锁、扣减库存一次,见 order/queue.py
+# 需要在线支付的订单写入数据库后登记支付截止时间,超时未支付时取消并归还库存,见 order/expiry.py
+
+# 订单运费
+TRANSIT_PRICE = 10
+
+
+class OrderCommitError(Exception):
+    """订单提交失败,res 和 errmsg 直接返回给前端"""
+    def __init__(self, res, errmsg):
+        super(OrderCommitError, self).__init__(errmsg)
+        self.res = res
+        self.errmsg = errmsg
+
+
+def make_order_id():
+    """
+    创建订单编号: 雪花算法 id,补齐为 20 位数字
+    定长的数字字符串按字节排序与数值顺序一致,订单编号随时间单调递增,不同进程、机器之间不会重复
+    """
+    return '%020d' % snowflake.next_id()
+
+
+def get_order_counts(user, sku_ids):
+    """
+    一次 hmget 读取购物车中商品的数量
+    返回 {sku_id: 数量},购物车中没有的商品视为不存在
+    """
+    conn = get_redis_connection('default')
+    counts = conn.hmget(cart_key(user.id), sku_ids)
+    if None in counts:
+        raise OrderCommitError(4, '商品不存在')
+    return {sku_id: int(count) for sku_id, count in zip(sku_ids, counts)}
+
+
+def _decrease_stock(counts):
+    """
+    一条 update 语句扣减所有商品的库存、增加销量
+    update df_goods_sku set stock = case when id = 1 then stock - 2 ... end, sales = ... where id in (...)
+    update 不会调用 save,手动更新 update_time
+    """
+    stock = Case(*[When(id=sku_id, then=F('stock') - count) for sku_id, count in counts.items()],
+                 output_field=IntegerField())
+    sales = Case(*[When(id=sku_id, then=F('sales') + count) for sku_id, count in counts.items()],
+                 output_field=IntegerField())
+    GoodsSKU.objects.filter(id__in=list(counts)).update(stock=stock, sales=sales, update_time=timezone.now())
+
+
+def _create_order(order_id, user, addr, pay_method, skus, counts):
+    """添加订单及订单商品,返回订单"""
+    total_count = sum(counts.values())
+    total_price = sum(sku.price * counts[sku.id] for sku in skus)
+
+    order = OrderInfo.objects.create(order_id=order_id,
+                                     user=user,
+                                     addr=addr,
+                                     pay_method=pay_method,
+                                     total_count=total_count,
+                                     total_price=total_price,
+                                     transit_price=TRANSIT_PRICE)
+
+    OrderGoods.objects.bulk_create([OrderGoods(order=order,
+                                               sku=sku,
+                                               count=counts[sku.id],
+                                               price=sku.price) for sku in skus])
+    return order
+
+
+def _sync_stock(skus, counts):
+    """
+    update 不会发出 post_save 信号,手动更新种类销量排行、在售商品库存,并标记需要重新生成的静态页面
+    skus 中的 stock 需为扣减后的库存
+    """
+    incr_sales_rank([(sku.type_id, sku.id, counts[sku.id]) for sku in skus])
+    set_skus_stock({sku.id: sku.stock for sku in skus})
+    # 详情页的库存、列表页的销量排序发生变化
+    mark_static_dirty([sku.id for sku in skus], {sku.type_id for sku in skus})
+
+
+def finish_commit(user, skus, counts):
+    """事务提交后的 redis 操作: 同步销量排行和在售商品库存,再删除购物车记录"""
+    _sync_stock(skus, counts)
+    delete_cart(user.id, *counts)
+
+
+def pessimistic_commit(order_id, user, addr, pay_method, counts):
+    """
+    悲观锁提交订单
+    悲观锁: 通过给事务上锁的方式来使得多线程在操作数据库时产生的的数据共享的问题得以解决,
+    上锁过后,其他事务会阻塞直至事务结束(commit 或 rollback),锁解开
+    返回 (订单, 扣减库存后的商品列表)
+    """
+    sku_ids = sorted(counts)
+
+    with transaction.atomic():
+        # select * from df_goods_sku where id in (...) order by id for update
+        skus = list(GoodsSKU.objects.select_for_update().filter(id__in=sku_ids).order_by('id'))
+        if len(skus) != len(sku_ids):
+            raise OrderCommitError(4, '商品不存在')
+
+        # 判断商品库存
+        for sku in skus:
+            if counts[sku.id] > sku.stock:
+                raise OrderCommitError(6, '商品库存不足')
+
+        _decrease_stock(counts)
+        order = _create_order(order_id, user, addr, pay_method, skus, counts)
+
+    # 行已锁定,扣减后的库存可以直接计算
+    for sku in skus:
+        sku.stock -= counts[sku.id]
+
+    return order, skus
+
+
+def _conditional_commit(order_id, user, addr, pay_method, counts):
+    sku_ids = sorted(counts)
+
+    with transaction.atomic():
+        now = timezone.now()
+        # 按 id 顺序更新,减少并发订单之间的死锁
+        for sku_id in sku_ids:
+            # update df_goods_sku set stock = stock - count, sales = sales + count
+            # where id = sku_id and stock >= count
+            res = GoodsSKU.objects.filter(id=sku_id, stock__gte=counts[sku_id]).update(stock=F('stock') - counts[sku_id],
+                                                                                       sales=F('sales') + counts[sku_id],
+                                                                                       update_time=now)
+            if res == 0:
+                # 商品不存在或库存不足,事务回滚
+                if not GoodsSKU.objects.filter(id=sku_id).exists():
+                    raise OrderCommitError(4, '商品不存在')
+                raise OrderCommitError(6, '商品库存不足')
+
+        # 库存扣减完成后,一次查询取出价格和扣减后的库存,订单总数、总价只计算一次
+        skus = list(GoodsSKU.objects.filter(id__in=sku_ids).order_by('id'))
+        order = _create_order(order_id, user, addr, pay_method, skus, counts)
+
+    return order, skus
+
+
+def optimistic_commit(order_id, user, addr, pay_method, counts):
+    """
+    乐观锁提交订单
+    死锁、锁等待超时时回滚并重试,第 n 次重试前随机等待 0 ~ ORDER_COMMIT_BACKOFF * 2^n 秒,
+    避免冲突的事务同时重试再次冲突
+    返回 (订单, 扣减库存后的商品列表)
+    """
+    retries = settings.ORDER_COMMIT_RETRIES
+    for i in range(retries + 1):
+        try:
+            return _conditional_commit(order_id, user, addr, pay_method, counts)
+        except OperationalError:
+            if i == retries:
+                raise OrderCommitError(7, '下单失败,请重试')
+            time.sleep(random.uniform(0, settings.ORDER_COMMIT_BACKOFF * 2 ** i))
+
+
+# 订单提交方式
+COMMIT_MODES = {'pessimistic': pessimistic_commit,
+                'optimistic': optimistic_commit}
+
+
+def commit_order(user, addr, pay_method, sku_ids, mode=None):
+    """
+    提交订单,mode 为 None 时使用 settings.ORDER_COMMIT_MODE
+    库存不足、商品不存在时抛出 OrderCommitError,事务回滚
+    返回 (订单编号, 是否放入订单队列),放入订单队列的订单由 celery 任务写入数据库
+    """
+    sku_ids = sorted(set(int(sku_id) for sku_id in sku_ids))
+    counts = get_order_counts(user, sku_ids)
+    order_id = make_order_id()
+
+    # 秒杀商品在 redis 中预留库存
+    res = reserve_order(order_id, user, addr, pay_method, counts)
+    if res == RESERVE_OK:
+        delete_cart(user.id, *counts)
+        return order_id, True
+    if res == RESERVE_NO_STOCK:
+        raise OrderCommitError(6, '商品库存不足')
+    if res == RESERVE_MIXED:
+        raise OrderCommitError(8, '秒杀商品需单独下单')
+
+    # 排队下单,购物车记录在订单创建成功后删除
+    if settings.ORDER_COMMIT_QUEUED:
+        enqueue_order(order_id, user, addr, pay_method, counts)
+        return order_id, True
+
+    commit = COMMIT_MODES[mode or settings.ORDER_COMMIT_MODE]
+    order, skus = commit(order_id, user, addr, pay_method, counts)
+    finish_commit(user, skus, counts)
+    if needs_payment(pay_method):
+        schedule_expiry([order.order_id])
+
+    return order.order_id, False
+
+
+def _persist_orders(orders):
+    """
+    在一个事务中写入一批订单队列中的订单
+    整批订单涉及的商品只按 id 顺序上锁一次,按队列顺序在内存中依次校验、扣减库存,
+    再使用一条 update 扣减整批的库存,订单和订单商品各使用一次 bulk_create
+    已经写入的订单跳过,任务中断后重新处理同一批订单时不会重复写入
+    返回 (写入的订单, 库存不足或商品不存在的订单)
+    """
+    order_ids = [order['order_id'] for order in orders]
+    existing = set(OrderInfo.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+    created = [order for order in orders if order['order_id'] in existing]
+    orders = [order for order in orders if order['order_id'] not in existing]
+    if not orders:
+        return created, []
+
+    sku_ids = set()
+    for order in orders:
+        sku_ids.update(order['counts'])
+
+    rejected = []
+    accepted = []
+    # 按商品汇总整批的购买数量
+    counts = {}
+
+    with transaction.atomic():
+        skus = {sku.id: sku for sku in GoodsSKU.objects.select_for_update().filter(id__in=list(sku_ids)).order_by('id')}
+
+        order_infos = []
+        order_goods = []
+        for order in orders:
+            # 商品不存在或库存不足
+            if any(sku_id not in skus or skus[sku_id].stock < count for sku_id, count in order['counts'].items()):
+                rejected.append(order)
+                continue
+
+            for sku_id, count in order['counts'].items():
+                skus[sku_id].stock -= count
+                counts[sku_id] = counts.get(sku_id, 0) + count
+            accepted.append(order)
+
+            order_infos.append(OrderInfo(order_id=order['order_id'],
+                                         user_id=order['user_id'],
+                                         addr_id=order['addr_id'],
+                                         pay_method=order['pay_method'],
+                                         total_count=sum(order['counts'].values()),
+                                         total_price=sum(skus[sku_id].price * count for sku_id, count in order['counts'].items()),
+                                         transit_price=TRANSIT_PRICE))
+            order_goods.extend(OrderGoods(order_id=order['order_id'],
+                                          sku_id=sku_id,
+                                          count=count,
+                                          price=skus[sku_id].price) for sku_id, count in order['counts'].items())
+
+        if accepted:
+            OrderInfo.objects.bulk_create(order_infos)
+            OrderGoods.objects.bulk_create(order_goods)
+            _decrease_stock(counts)
+
+    # skus 中的库存已在内存中扣减
+    _sync_stock([skus[sku_id] for sku_id in counts], counts)
+
+    return created + accepted, rejected
+
+
+def persist_orders(orders):
+    """
+    将订单队列中的一批订单写入数据库
+    整批写入出错时逐条写入,找出出错的订单
+    写入成功的排队订单删除购物车记录,需要在线支付的订单登记支付截止时间,
+    失败的秒杀订单归还 redis 中预留的库存
+    返回 (写入的订单编号, 失败的订单编号)
+    """
+    try:
+        created, failed = _persist_orders(orders)
+    except Exception as e:
+        created = []
+        failed = []
+        for order in orders:
+            try:
+                ok, rejected = _persist_orders([order])
+            except Exception as e:
+                ok, rejected = [], [order]
+            created.extend(ok)
+            failed.extend(rejected)
+
+    for order in created:
+        if not order['reserved']:
+            delete_cart(order['user_id'], *order['counts'])
+    schedule_expiry([order['order_id'] for order in created if needs_payment(order['pay_method'])])
+    for order in failed:
+        if order['reserved']:
+            release_reservation(order)
+
+    return [order['order_id'] for order in created], [order['order_id'] for order in failed]
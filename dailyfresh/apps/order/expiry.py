@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, IntegerField
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from goods.ranking import incr_sales_rank
+from goods.stock import set_skus_stock
+from goods.static_pages import mark_static_dirty
+from order.models import OrderInfo, OrderGoods
+from order.flash import release_reservation
+from utils.snowflake import id_time
+import time
+
+
+# 未支付订单超时取消
+# 需要在线支付的订单写入数据库后加入有序集合 order_expiry,分数为支付截止时间(订单编号中的生成时间 + ORDER_PAY_TIMEOUT),
+# 上线前已存在的待支付订单由 python manage.py schedule_unpaid_orders 一次性加入,
+# celery 定时任务按分数分批取出到期的订单(zrangebyscore O(log n + m)),只按主键访问 df_order_info,
+# 不扫描订单表,待支付订单的数目不影响每批的开销
+# 每批订单在一个事务中: 锁定仍为待支付的订单并改为已取消,一条 update 归还整批订单的库存、减少销量
+# 订单支付成功时移出有序集合,与取消同时发生时,两边都按 "待支付" 条件更新,只有一方生效
+
+# 等待支付的订单
+ORDER_EXPIRY_KEY = 'order_expiry'
+
+# 货到付款、待支付、已取消
+PAY_ON_DELIVERY = 1
+ORDER_UNPAID = 1
+ORDER_CANCELLED = 6
+
+
+def needs_payment(pay_method):
+    """货到付款的订单不需要在线支付,不会超时取消"""
+    return int(pay_method) != PAY_ON_DELIVERY
+
+
+def is_snowflake_order_id(order_id):
+    """
+    是否为雪花算法生成的订单编号
+    雪花算法 id 小于 2^63,补齐为 20 位后最高位总是 0,
+    旧版本的订单编号(下单时间 + 用户 id)以年份开头,不包含可解析的生成时间
+    """
+    return len(order_id) == 20 and order_id.startswith('0') and order_id.isdigit()
+
+
+def pay_deadline(order_id, create_time=None):
+    """
+    订单的支付截止时间
+    雪花算法订单编号使用编号中的生成时间,旧版本的订单编号使用订单的创建时间 create_time
+    """
+    if is_snowflake_order_id(order_id):
+        created = id_time(order_id)
+    else:
+        created = create_time.timestamp()
+    return created + settings.ORDER_PAY_TIMEOUT
+
+
+def schedule_expiry(order_ids):
+    """雪花算法编号的订单写入数据库后加入有序集合,重复加入时不改变截止时间"""
+    if not order_ids:
+        return
+    conn = get_redis_connection('default')
+    conn.zadd(ORDER_EXPIRY_KEY, {order_id: pay_deadline(order_id) for order_id in order_ids}, nx=True)
+
+
+def schedule_unpaid_orders(batch_size=1000):
+    """
+    将数据库中所有需要在线支付的待支付订单加入有序集合,用于上线前已存在的订单,可以重复执行
+    已超过支付截止时间的订单会在下一次取消任务中取消
+    返回加入的订单数
+    """
+    orders = (OrderInfo.objects.filter(order_status=ORDER_UNPAID).exclude(pay_method=PAY_ON_DELIVERY)
+              .values_list('order_id', 'create_time'))
+
+    conn = get_redis_connection('default')
+    count = 0
+    deadlines = {}
+    for order_id, create_time in orders.iterator():
+        deadlines[order_id] = pay_deadline(order_id, create_time)
+        if len(deadlines) >= batch_size:
+            count += conn.zadd(ORDER_EXPIRY_KEY, deadlines, nx=True)
+            deadlines = {}
+    if deadlines:
+        count += conn.zadd(ORDER_EXPIRY_KEY, deadlines, nx=True)
+
+    return count
+
+
+def unschedule_expiry(order_id):
+    """订单支付成功,不再取消"""
+    conn = get_redis_connection('default')
+    conn.zrem(ORDER_EXPIRY_KEY, order_id)
+
+
+def due_orders():
+    """取出一批超过支付截止时间的订单编号"""
+    conn = get_redis_connection('default')
+    order_ids = conn.zrangebyscore(ORDER_EXPIRY_KEY, 0, time.time(), start=0, num=settings.ORDER_EXPIRY_BATCH)
+    return [order_id.decode() for order_id in order_ids]
+
+
+def _restore_stock(counts):
+    """
+    一条 update 语句归还所有商品的库存、减少销量
+    update df_goods_sku set stock = case when id = 1 then stock + 2 ... end, sales = ... where id in (...)
+    """
+    stock = Case(*[When(id=sku_id, then=F('stock') + count) for sku_id, count in counts.items()],
+                 output_field=IntegerField())
+    sales = Case(*[When(id=sku_id, then=F('sales') - count) for sku_id, count in counts.items()],
+                 output_field=IntegerField())
+    GoodsSKU.objects.filter(id__in=list(counts)).update(stock=stock, sales=sales, update_time=timezone.now())
+
+
+def cancel_orders(order_ids):
+    """
+    取消一批到期的订单,归还库存
+    已经不是待支付状态(已支付)的订单跳过,处理完成后整批移出有序集合
+    返回取消的订单编号
+    """
+    counts = {}
+    skus = []
+
+    with transaction.atomic():
+        # select order_id from df_order_info where order_id in (...) and order_status = 1 for update
+        cancelled = list(OrderInfo.objects.select_for_update().filter(order_id__in=order_ids,
+                                                                      order_status=ORDER_UNPAID)
+                         .values_list('order_id', flat=True))
+        if cancelled:
+            OrderInfo.objects.filter(order_id__in=cancelled).update(order_status=ORDER_CANCELLED,
+                                                                    update_time=timezone.now())
+
+            # 按商品汇总整批订单的购买数量
+            for sku_id, count in OrderGoods.objects.filter(order_id__in=cancelled).values_list('sku_id', 'count'):
+                counts[sku_id] = counts.get(sku_id, 0) + count
+
+            _restore_stock(counts)
+            # 行已被 update 锁定,读取到的是归还后的库存
+            skus = list(GoodsSKU.objects.filter(id__in=list(counts)).only('id', 'type_id', 'stock'))
+
+    # 事务提交后同步 redis 中的销量排行、在售商品库存和静态页面,秒杀商品归还预留的库存
+    if counts:
+        incr_sales_rank([(sku.type_id, sku.id, -counts[sku.id]) for sku in skus])
+        set_skus_stock({sku.id: sku.stock for sku in skus})
+        mark_static_dirty([sku.id for sku in skus], {sku.type_id for sku in skus})
+        release_reservation({'counts': counts})
+
+    conn = get_redis_connection('default')
+    conn.zrem(ORDER_EXPIRY_KEY, *order_ids)
+
+    return cancelled
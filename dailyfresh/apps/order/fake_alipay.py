@@ -0,0 +1,82 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+from urllib.parse import urlencode
+import hashlib
+import hmac
+import time
+
+
+# 本地模拟的支付宝网关,用于开发和测试,settings.ALIPAY_FAKE 为 True 时使用
+# FakeAliPay 提供与 AliPay 相同的接口: 生成支付参数、查询交易、退款、验证异步通知的签名
+# 交易状态保存在 redis 中,由 order/fake_gateway 页面模拟用户付款,并像支付宝一样发送异步通知
+
+# 模拟交易的保存时间(秒)
+FAKE_TRADE_TIMEOUT = 24 * 3600
+
+
+def _trade_key(order_id):
+    return 'fake_alipay_trade_%s' % order_id
+
+
+def fake_sign(data):
+    """使用 SECRET_KEY 对参数签名,代替支付宝的 RSA 签名"""
+    message = '&'.join('%s=%s' % (key, data[key]) for key in sorted(data))
+    return hmac.new(settings.SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+class FakeAliPay(object):
+    def api_alipay_trade_page_pay(self, out_trade_no, total_amount, subject, return_url=None, notify_url=None, **kwargs):
+        """生成支付参数,拼接在网关地址后"""
+        data = {'out_trade_no': out_trade_no, 'total_amount': total_amount, 'subject': subject}
+        data['sign'] = fake_sign(data)
+        return urlencode(data)
+
+    def api_alipay_trade_query(self, out_trade_no):
+        """查询交易,用户还没有打开支付页面时,与支付宝一样返回 40004(交易不存在)"""
+        conn = get_redis_connection('default')
+        trade = conn.hgetall(_trade_key(out_trade_no))
+        if not trade:
+            return {'code': '40004', 'sub_code': 'ACQ.TRADE_NOT_EXIST'}
+        trade = {key.decode(): value.decode() for key, value in trade.items()}
+        return dict(trade, code='10000', out_trade_no=out_trade_no)
+
+    def api_alipay_trade_refund(self, refund_amount, out_trade_no=None, trade_no=None, **kwargs):
+        """退款,只有已付款的交易可以退款"""
+        conn = get_redis_connection('default')
+        key = _trade_key(out_trade_no)
+        if conn.hget(key, 'trade_status') != b'TRADE_SUCCESS':
+            return {'code': '40004', 'sub_code': 'ACQ.TRADE_STATUS_ERROR', 'sub_msg': '交易状态不合法'}
+        conn.hmset(key, {'trade_status': 'TRADE_CLOSED', 'refund_fee': refund_amount})
+        return {'code': '10000', 'fund_change': 'Y', 'out_trade_no': out_trade_no, 'refund_fee': refund_amount}
+
+    def verify(self, data, signature):
+        return hmac.compare_digest(fake_sign(data), signature)
+
+    def open_trade(self, out_trade_no, total_amount):
+        """模拟用户打开支付页面,创建等待付款的交易"""
+        conn = get_redis_connection('default')
+        key = _trade_key(out_trade_no)
+        conn.hsetnx(key, 'trade_status', 'WAIT_BUYER_PAY')
+        conn.hset(key, 'total_amount', total_amount)
+        conn.expire(key, FAKE_TRADE_TIMEOUT)
+
+    def pay_trade(self, out_trade_no):
+        """
+        模拟用户付款成功,返回支付宝异步通知的参数
+        交易不存在(没有打开过支付页面或已过期)时返回 None
+        """
+        conn = get_redis_connection('default')
+        key = _trade_key(out_trade_no)
+        if not conn.exists(key):
+            return None
+        trade_no = 'fake%d' % int(time.time() * 1000)
+        conn.hmset(key, {'trade_status': 'TRADE_SUCCESS', 'trade_no': trade_no})
+
+        data = {'app_id': settings.ALIPAY_APPID,
+                'out_trade_no': out_trade_no,
+                'trade_no': trade_no,
+                'trade_status': 'TRADE_SUCCESS',
+                'total_amount': conn.hget(key, 'total_amount').decode()}
+        data['sign'] = fake_sign(data)
+        data['sign_type'] = 'FAKE'
+        return data
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+from order.queue import ORDER_QUEUE_KEY, order_status_key, dump_order
+
+
+# 秒杀库存预留
+# 秒杀商品的库存预先加载到 redis hash flash_stock 中(sku_id 为属性,可预留的库存为值),只有在该 hash 中的商品才是秒杀商品
+# 下单时使用 lua 脚本原子地校验并扣减 redis 中的库存,同时将订单放入订单队列(见 order/queue.py),不访问 mysql,
+# 热点商品的下单吞吐量只受 redis 限制,不再受单行 InnoDB 行锁限制
+# celery 任务分批从队列中取出订单,写入订单、订单商品,并扣减 mysql 中的库存、增加销量,
+# 写入失败的订单归还 redis 中的库存(补偿),订单状态记为失败
+# 使用 python manage.py flash_sale start/stop 商品id 开始、结束秒杀
+
+# 秒杀商品可预留的库存
+FLASH_STOCK_KEY = 'flash_stock'
+
+# 预留结果
+# 订单中没有秒杀商品,按普通方式下单
+RESERVE_NONE = -1
+# 订单中同时有秒杀商品和普通商品
+RESERVE_MIXED = -2
+# 秒杀商品库存不足
+RESERVE_NO_STOCK = 0
+# 预留成功
+RESERVE_OK = 1
+
+# 预留库存
+# KEYS[1]: 秒杀库存 hash, KEYS[2]: 订单队列, KEYS[3]: 订单状态
+# ARGV[1]: 订单记录, ARGV[2]: 订单状态的过期时间, ARGV[3...]: sku_id, 数量, sku_id, 数量...
+RESERVE_SCRIPT = """
+local flagged = 0
+for i = 3, #ARGV, 2 do
+    local stock = redis.call('HGET', KEYS[1], ARGV[i])
+    if stock then
+        flagged = flagged + 1
+        if tonumber(stock) < tonumber(ARGV[i + 1]) then
+            return 0
+        end
+    end
+end
+
+if flagged == 0 then
+    return -1
+end
+if flagged < (#ARGV - 2) / 2 then
+    return -2
+end
+
+for i = 3, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('SET', KEYS[3], 'pending', 'EX', ARGV[2])
+return 1
+"""
+
+# 归还预留的库存,秒杀已结束的商品不再归还
+# KEYS[1]: 秒杀库存 hash, ARGV: sku_id, 数量, sku_id, 数量...
+RELEASE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+
+def _count_args(counts):
+    args = []
+    for sku_id, count in counts.items():
+        args.extend([sku_id, count])
+    return args
+
+
+def reserve_order(order_id, user, addr, pay_method, counts):
+    """
+    为秒杀订单预留库存
+    counts: {sku_id: 数量}
+    返回预留结果 RESERVE_*,预留成功时订单已放入订单队列
+    """
+    conn = get_redis_connection('default')
+    keys = [FLASH_STOCK_KEY, ORDER_QUEUE_KEY, order_status_key(order_id, user.id)]
+    args = [dump_order(order_id, user, addr, pay_method, counts, True),
+            settings.ORDER_STATUS_TIMEOUT] + _count_args(counts)
+    return conn.register_script(RESERVE_SCRIPT)(keys=keys, args=args)
+
+
+def release_reservation(order):
+    """补偿: 秒杀订单写入数据库失败时,归还预留的库存"""
+    conn = get_redis_connection('default')
+    conn.register_script(RELEASE_SCRIPT)(keys=[FLASH_STOCK_KEY], args=_count_args(order['counts']))
+
+
+def start_flash_sale(stocks):
+    """
+    开始秒杀,加载商品可预留的库存
+    stocks: {sku_id: 库存}
+    """
+    conn = get_redis_connection('default')
+    conn.hmset(FLASH_STOCK_KEY, stocks)
+
+
+def stop_flash_sale(sku_ids):
+    """结束秒杀,商品恢复按普通方式下单"""
+    conn = get_redis_connection('default')
+    conn.hdel(FLASH_STOCK_KEY, *sku_ids)
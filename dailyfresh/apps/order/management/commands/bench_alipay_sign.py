@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from order.payment import get_alipay, create_alipay
+import time
+
+
+class Command(BaseCommand):
+    """
+    支付签名压测,比较每次请求都创建支付宝客户端与进程内共用客户端的签名吞吐量
+    只在本地生成签名后的支付链接参数,不访问支付宝
+    """
+    help = '支付签名压测: python manage.py bench_alipay_sign --count 1000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='每种方式签名的次数')
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        def sign(alipay, i):
+            return alipay.api_alipay_trade_page_pay(out_trade_no='bench%d' % i,
+                                                    total_amount='10.00',
+                                                    subject='天天生鲜',
+                                                    return_url=None,
+                                                    notify_url=None)
+
+        # 每次请求都读取密钥文件、解析密钥、创建客户端
+        start = time.time()
+        for i in range(count):
+            sign(create_alipay(), i)
+        self._report('每次创建', count, time.time() - start)
+
+        # 进程内共用客户端,只在第一次调用时创建
+        start = time.time()
+        for i in range(count):
+            sign(get_alipay(), i)
+        self._report('共用客户端', count, time.time() - start)
+
+    def _report(self, name, count, elapsed):
+        self.stdout.write('%s: 签名 %d 次, 耗时 %.2fs, 吞吐量 %.1f 次/s, 平均 %.2fms' % (
+            name, count, elapsed, count / elapsed, elapsed / count * 1000))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ThreadPoolExecutor
+from goods.models import GoodsSKU
+from user.models import User, Address
+from order.models import OrderInfo
+from order.commit import COMMIT_MODES, OrderCommitError
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    """
+    订单提交并发压测,比较悲观锁与乐观锁在热点商品上的吞吐量和延迟
+    多个线程同时为同一批商品下单,每个线程使用独立的数据库连接
+    压测前将商品库存设置为刚好满足所有订单,压测后删除压测订单,并恢复商品的库存和销量
+    每个线程的数据库连接在线程内复用,不计入建立连接的时间,命令结束时随进程关闭
+    只操作数据库,不读写 redis 中的购物车、排行,请勿在生产库上运行
+    """
+    help = '订单提交并发压测: python manage.py bench_order_commit --user 用户名 --sku 商品id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='下单用户的用户名,需要有收货地址')
+        parser.add_argument('--sku', type=int, nargs='+', required=True, help='每个订单购买的商品 id')
+        parser.add_argument('--count', type=int, default=1, help='每个商品购买的数量')
+        parser.add_argument('--orders', type=int, default=200, help='每种方式提交的订单数')
+        parser.add_argument('--threads', type=int, default=20, help='并发线程数')
+        parser.add_argument('--mode', choices=list(COMMIT_MODES), nargs='+', default=sorted(COMMIT_MODES),
+                            help='压测的订单提交方式')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('用户不存在')
+
+        addr = Address.objects.filter(user=user).first()
+        if addr is None:
+            raise CommandError('用户没有收货地址')
+
+        counts = {sku_id: options['count'] for sku_id in options['sku']}
+        origin = {sku.id: (sku.stock, sku.sales) for sku in GoodsSKU.objects.filter(id__in=list(counts))}
+        if len(origin) != len(counts):
+            raise CommandError('商品不存在')
+
+        for mode in options['mode']:
+            prefix = 'bench%s' % uuid.uuid4().hex[:8]
+            # 库存刚好满足所有订单
+            GoodsSKU.objects.filter(id__in=list(counts)).update(stock=options['orders'] * options['count'])
+            try:
+                result = self._run(COMMIT_MODES[mode], prefix, user, addr, counts, options)
+            finally:
+                # 删除压测订单(订单商品级联删除),恢复库存和销量
+                OrderInfo.objects.filter(order_id__startswith=prefix).delete()
+                for sku_id, (stock, sales) in origin.items():
+                    GoodsSKU.objects.filter(id=sku_id).update(stock=stock, sales=sales)
+
+            self._report(mode, result, options)
+
+    def _run(self, commit, prefix, user, addr, counts, options):
+        def submit(i):
+            start = time.time()
+            try:
+                commit('%s%06d' % (prefix, i), user, addr, 1, counts)
+                ok = True
+            except OrderCommitError:
+                ok = False
+            return ok, time.time() - start
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(submit, range(options['orders'])))
+        return results, time.time() - start
+
+    def _report(self, mode, result, options):
+        results, elapsed = result
+        latencies = sorted(latency for ok, latency in results)
+        success = sum(1 for ok, latency in results if ok)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write('%s: %d 个线程, 成功 %d/%d, 耗时 %.2fs, 吞吐量 %.1f 单/s, p50 %.1fms, p99 %.1fms' % (
+            mode, options['threads'], success, len(results), elapsed, len(results) / elapsed,
+            percentile(0.5), percentile(0.99)))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from user.models import User, Address
+from order.models import OrderInfo
+from order.commit import make_order_id, TRANSIT_PRICE
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    """
+    订单插入压测,比较随机订单编号与单调递增的雪花算法订单编号写入 df_order_info 的吞吐量
+    随机编号(uuid)插入在聚簇索引的随机位置,数据量大时会频繁页分裂,
+    单调递增的编号总是追加在索引末尾
+    每条订单单独插入(自动提交),与下单时一致,压测结束后删除压测订单,请勿在生产库上运行
+    """
+    help = '订单插入压测: python manage.py bench_order_insert --user 用户名 --rows 20000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='订单所属用户的用户名,需要有收货地址')
+        parser.add_argument('--rows', type=int, default=20000, help='每种编号插入的订单数')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('用户不存在')
+
+        addr = Address.objects.filter(user=user).first()
+        if addr is None:
+            raise CommandError('用户没有收货地址')
+
+        # 随机编号加上前缀,便于压测结束后删除
+        generators = [('random', lambda: 'bench' + uuid.uuid4().hex),
+                      ('snowflake', make_order_id)]
+
+        for name, generator in generators:
+            order_ids = [generator() for i in range(options['rows'])]
+            start = time.time()
+            try:
+                for order_id in order_ids:
+                    OrderInfo.objects.create(order_id=order_id,
+                                             user=user,
+                                             addr=addr,
+                                             total_count=1,
+                                             total_price=0,
+                                             transit_price=TRANSIT_PRICE)
+                elapsed = time.time() - start
+            finally:
+                for i in range(0, len(order_ids), 1000):
+                    OrderInfo.objects.filter(order_id__in=order_ids[i:i + 1000]).delete()
+
+            self.stdout.write('%s: 插入 %d 条, 耗时 %.2fs, 吞吐量 %.1f 条/s' % (
+                name, len(order_ids), elapsed, len(order_ids) / elapsed))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from goods.models import GoodsSKU
+from order.flash import start_flash_sale, stop_flash_sale
+from celery_tasks.tasks import persist_order_queue
+
+
+class Command(BaseCommand):
+    """开始、结束商品秒杀"""
+    help = '开始秒杀: python manage.py flash_sale start 商品id..., 结束秒杀: python manage.py flash_sale stop 商品id...'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['start', 'stop'])
+        parser.add_argument('sku_ids', type=int, nargs='+')
+
+    def handle(self, *args, **options):
+        sku_ids = options['sku_ids']
+
+        if options['action'] == 'start':
+            # 将数据库中的库存加载到 redis,秒杀期间库存只在 redis 中扣减
+            stocks = dict(GoodsSKU.objects.filter(id__in=sku_ids, is_delete=False).values_list('id', 'stock'))
+            if len(stocks) != len(set(sku_ids)):
+                raise CommandError('商品不存在')
+            start_flash_sale(stocks)
+            self.stdout.write('已开始秒杀 %d 个商品' % len(stocks))
+        else:
+            # 结束后立即写入订单队列中剩余的订单
+            stop_flash_sale(sku_ids)
+            persist_order_queue()
+            self.stdout.write('已结束秒杀 %d 个商品' % len(sku_ids))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from order.payment import refund_payments
+
+
+class Command(BaseCommand):
+    """为超时取消后才付款的订单退款"""
+    help = '订单超时取消后才确认的付款记录在 redis 的 pay_refund 中,向支付宝发起退款,失败的交易保留,可以再次执行'
+
+    def handle(self, *args, **options):
+        refunded, failed = refund_payments()
+        for order_id, message in failed:
+            self.stderr.write('订单 %s 退款失败: %s' % (order_id, message))
+        self.stdout.write('已退款 %d 个订单,%d 个订单退款失败' % (len(refunded), len(failed)))
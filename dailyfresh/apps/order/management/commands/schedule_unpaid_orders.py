@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from order.expiry import schedule_unpaid_orders
+
+
+class Command(BaseCommand):
+    """将已存在的待支付订单加入超时取消的有序集合"""
+    help = '上线超时取消功能后执行一次,将数据库中需要在线支付的待支付订单加入 order_expiry,已超时的订单随后被取消'
+
+    def handle(self, *args, **options):
+        count = schedule_unpaid_orders()
+        self.stdout.write('已加入 %d 个待支付订单' % count)
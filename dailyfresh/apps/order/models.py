@@ -24,7 +24,8 @@ class OrderInfo(BaseModel):
         '2': '待发货',
         '3': '待收货',
         '4': '待评价',
-        '5': '已完成'
+        '5': '已完成',
+        '6': '已取消',
     }
 
     ORDER_STATUS_CHOICES = (
@@ -32,7 +33,8 @@ class OrderInfo(BaseModel):
         (2, '待发货'),
         (3, '待收货'),
         (4, '待评价'),
-        (5, '已完成')
+        (5, '已完成'),
+        (6, '已取消'),
     )
 
     order_id = models.CharField(max_length=128, primary_key=True, verbose_name='订单 id')
@@ -63,3 +65,5 @@ class OrderGoods(BaseModel):
         db_table = 'df_order_goods'
         verbose_name = '订单商品'
         verbose_name_plural = verbose_name
+        # 商品评论按 商品 + 创建时间 分页查询
+        index_together = [('sku', 'create_time')]
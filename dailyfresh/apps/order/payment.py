@@ -0,0 +1,257 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+from alipay import AliPay
+from order.models import OrderInfo
+from order.fake_alipay import FakeAliPay
+from order.expiry import unschedule_expiry, ORDER_UNPAID, ORDER_CANCELLED
+from decimal import Decimal, InvalidOperation
+import threading
+import time
+
+
+# 支付宝客户端
+# 创建 AliPay 对象时需要读取并解析 RSA 密钥,耗时较长,每个进程只创建一次,之后所有请求共用
+# AliPay 对象创建后只读,签名、验签不修改对象状态,可以在多个线程之间共用
+#
+# 支付结果确认
+# 支付结果不在请求中同步查询,两种方式确认:
+# 1. 支付宝的异步通知(notify_url),验证签名后更新订单状态
+# 2. 用户打开支付页面后,订单加入有序集合 pay_pending(分数为下次查询的时间),
+#    celery 定时任务分批查询到期的订单,未付款时按指数退避推迟下次查询,超过最多查询次数后不再查询
+# 支付状态保存在 redis 的 pay_status_订单编号 中,前端轮询的接口只读取 redis
+# 订单超时取消后才确认的付款(迟到的通知、推迟的查询),订单不会改为已支付,交易记录在 pay_refund 中等待退款,
+# 由 python manage.py refund_payments 向支付宝发起退款,退款成功后移出 pay_refund
+
+# 等待确认支付结果的订单
+PAY_PENDING_KEY = 'pay_pending'
+# 订单已查询的次数
+PAY_ATTEMPTS_KEY = 'pay_attempts'
+# 订单已取消但付款成功、需要退款的交易,订单编号为属性,支付宝交易号为值
+PAY_REFUND_KEY = 'pay_refund'
+
+# 支付状态
+PAY_WAITING = 'waiting'
+PAY_PAID = 'paid'
+PAY_FAILED = 'failed'
+
+# 待评价
+ORDER_PAID = 4
+
+_alipay = None
+_lock = threading.Lock()
+
+
+def _read_key(path):
+    with open(path) as f:
+        return f.read()
+
+
+def get_alipay():
+    """获取进程内共用的支付宝客户端,第一次调用时创建"""
+    global _alipay
+    if _alipay is None:
+        with _lock:
+            if _alipay is None:
+                _alipay = FakeAliPay() if settings.ALIPAY_FAKE else create_alipay()
+    return _alipay
+
+
+def create_alipay():
+    """创建支付宝客户端,读取并解析密钥"""
+    return AliPay(
+        appid=settings.ALIPAY_APPID,
+        app_notify_url=settings.ALIPAY_NOTIFY_URL,  # 默认回调url,接收支付宝的异步通知
+        # app_private_key 获取用户的私钥,用来对用户向 alipay 发送的数据进行加密
+        app_private_key_string=_read_key(settings.ALIPAY_APP_PRIVATE_KEY_PATH),
+        # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
+        alipay_public_key_string=_read_key(settings.ALIPAY_PUBLIC_KEY_PATH),
+        sign_type="RSA2",  # RSA 或者 RSA2,推荐使用 RSA2
+        debug=settings.ALIPAY_DEBUG  # 默认False,访问真实环境,改为 True,访问沙箱环境
+    )
+
+
+def pay_status_key(order_id):
+    return 'pay_status_%s' % order_id
+
+
+def get_pay_status(order_id):
+    """获取支付状态,没有记录时返回 None"""
+    conn = get_redis_connection('default')
+    status = conn.get(pay_status_key(order_id))
+    return status.decode() if status is not None else None
+
+
+def _set_pay_status(order_id, status):
+    """记录支付状态,停止查询支付结果"""
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    pl.zrem(PAY_PENDING_KEY, order_id)
+    pl.hdel(PAY_ATTEMPTS_KEY, order_id)
+    pl.set(pay_status_key(order_id), status, ex=settings.ORDER_STATUS_TIMEOUT)
+    pl.execute()
+
+
+def watch_payment(order_id):
+    """用户打开支付页面后,开始定时查询支付结果"""
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    pl.zadd(PAY_PENDING_KEY, {order_id: time.time() + settings.PAY_POLL_INTERVAL})
+    pl.hdel(PAY_ATTEMPTS_KEY, order_id)
+    pl.set(pay_status_key(order_id), PAY_WAITING, ex=settings.ORDER_STATUS_TIMEOUT)
+    pl.execute()
+
+
+def mark_paid(order_id, trade_no):
+    """
+    支付成功,更新订单状态为待评价,不再超时取消
+    只更新待支付的订单,异步通知和定时查询同时确认时不会重复处理
+    订单已超时取消时不更新,交易记录到 pay_refund 等待退款,支付状态记为失败
+    返回订单是否已支付
+    """
+    updated = OrderInfo.objects.filter(order_id=order_id, order_status=ORDER_UNPAID).update(order_status=ORDER_PAID,
+                                                                                           trade_no=trade_no)
+    if not updated and OrderInfo.objects.filter(order_id=order_id, order_status=ORDER_CANCELLED).exists():
+        conn = get_redis_connection('default')
+        conn.hset(PAY_REFUND_KEY, order_id, trade_no)
+        _set_pay_status(order_id, PAY_FAILED)
+        return False
+
+    unschedule_expiry(order_id)
+    _set_pay_status(order_id, PAY_PAID)
+    return True
+
+
+def mark_failed(order_id):
+    """交易关闭或超过最多查询次数"""
+    _set_pay_status(order_id, PAY_FAILED)
+
+
+def handle_notify(data):
+    """
+    处理支付宝的异步通知
+    data: 通知的参数,验证签名、应用 id 和金额后,支付成功时更新订单状态
+    返回通知是否有效
+    """
+    data = dict(data)
+    signature = data.pop('sign', None)
+    data.pop('sign_type', None)
+    if not signature or not get_alipay().verify(data, signature):
+        return False
+
+    # 签名有效的通知也可能是发给其他应用的
+    if data.get('app_id') != settings.ALIPAY_APPID:
+        return False
+
+    if data.get('trade_status') not in ('TRADE_SUCCESS', 'TRADE_FINISHED'):
+        return True
+
+    try:
+        order = OrderInfo.objects.get(order_id=data.get('out_trade_no'))
+    except OrderInfo.DoesNotExist:
+        return False
+
+    # 支付金额需与订单金额一致
+    try:
+        total_amount = Decimal(data.get('total_amount', ''))
+    except InvalidOperation:
+        return False
+    if total_amount != order.total_price + order.transit_price:
+        return False
+
+    # 订单已取消时交易记录到 pay_refund 等待退款,同样告知支付宝通知已处理,不再重复通知
+    mark_paid(order.order_id, data.get('trade_no', ''))
+    return True
+
+
+def due_payments():
+    """取出一批到达查询时间的订单编号"""
+    conn = get_redis_connection('default')
+    order_ids = conn.zrangebyscore(PAY_PENDING_KEY, 0, time.time(), start=0, num=settings.PAY_POLL_BATCH)
+    return [order_id.decode() for order_id in order_ids]
+
+
+def postpone_payments(order_ids):
+    """
+    推迟下次查询,第 n 次查询后等待 PAY_POLL_INTERVAL * 2^n 秒,最多等待 PAY_POLL_MAX_INTERVAL 秒
+    超过最多查询次数的订单不再查询,返回这些订单编号
+    """
+    if not order_ids:
+        return []
+
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    for order_id in order_ids:
+        pl.hincrby(PAY_ATTEMPTS_KEY, order_id, 1)
+    attempts = pl.execute()
+
+    now = time.time()
+    expired = []
+    for order_id, attempt in zip(order_ids, attempts):
+        if attempt >= settings.PAY_POLL_MAX_ATTEMPTS:
+            expired.append(order_id)
+            continue
+        delay = min(settings.PAY_POLL_INTERVAL * 2 ** attempt, settings.PAY_POLL_MAX_INTERVAL)
+        pl.zadd(PAY_PENDING_KEY, {order_id: now + delay})
+    pl.execute()
+
+    return expired
+
+
+def check_payment(order_id):
+    """
+    向支付宝查询一个订单的支付结果
+    返回 True(已处理完成) 或 False(尚未付款,稍后继续查询)
+    """
+    # 获取支付网关码
+    # 10000 接口调用成功
+    # 20000 服务不可用,稍后重试
+    # 40004 接口调用成功,但是业务代码处理失败(如用户还没有扫码,交易不存在),稍后重试
+    response = get_alipay().api_alipay_trade_query(out_trade_no=order_id)
+    code = response.get('code')
+    status = response.get('trade_status')
+
+    if code == '10000' and status in ('TRADE_SUCCESS', 'TRADE_FINISHED'):
+        mark_paid(order_id, response.get('trade_no', ''))
+        return True
+
+    if code == '10000' and status == 'TRADE_CLOSED':
+        mark_failed(order_id)
+        return True
+
+    return False
+
+
+def refund_payments():
+    """
+    为 pay_refund 中已取消订单的付款向支付宝发起全额退款
+    退款请求号使用订单编号,重复发起时支付宝不会重复退款,退款成功的交易移出 pay_refund
+    返回 (退款成功的订单编号列表, 退款失败的 (订单编号, 错误信息) 列表)
+    """
+    conn = get_redis_connection('default')
+    trades = {order_id.decode(): trade_no.decode() for order_id, trade_no in conn.hgetall(PAY_REFUND_KEY).items()}
+    amounts = {order.order_id: order.total_price + order.transit_price
+               for order in OrderInfo.objects.filter(order_id__in=list(trades)).only('order_id', 'total_price',
+                                                                                   'transit_price')}
+
+    refunded = []
+    failed = []
+    for order_id, trade_no in trades.items():
+        if order_id not in amounts:
+            failed.append((order_id, '订单不存在'))
+            continue
+        try:
+            response = get_alipay().api_alipay_trade_refund(refund_amount=str(amounts[order_id]),
+                                                            out_trade_no=order_id,
+                                                            trade_no=trade_no,
+                                                            out_request_no=order_id)
+        except Exception as e:
+            failed.append((order_id, str(e)))
+            continue
+
+        if response.get('code') == '10000':
+            conn.hdel(PAY_REFUND_KEY, order_id)
+            refunded.append(order_id)
+        else:
+            failed.append((order_id, response.get('sub_msg') or response.get('msg', '')))
+
+    return refunded, failed
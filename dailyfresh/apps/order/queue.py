@@ -0,0 +1,102 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+import json
+
+
+# 订单队列
+# 等待写入数据库的订单放入 redis 队列 order_queue,由 celery 任务分批取出写入数据库
+# 队列中的订单有两种:
+# 1. 秒杀订单(reserved 为 true),库存已在 redis 中预留,见 order/flash.py
+# 2. 排队下单(settings.ORDER_COMMIT_QUEUED)的订单,写入数据库时才校验库存
+# 订单记录: {"order_id", "user_id", "addr_id", "pay_method", "counts": {sku_id: 数量}, "reserved"}
+# 订单状态保存在 order_status_用户id_订单编号 中: pending(等待写入), created(已创建), failed(失败),
+# 键中包含用户 id,用户只能查询到自己的订单状态
+
+# 等待写入数据库的订单
+ORDER_QUEUE_KEY = 'order_queue'
+# 正在写入数据库的订单,任务中断时下次继续处理
+ORDER_PROCESSING_KEY = 'order_queue_processing'
+
+ORDER_PENDING = 'pending'
+ORDER_CREATED = 'created'
+ORDER_FAILED = 'failed'
+
+# 取出一批订单,上次中断的订单优先处理
+# KEYS[1]: 订单队列, KEYS[2]: 正在处理的订单, ARGV[1]: 批大小
+POP_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+if #items > 0 then
+    return items
+end
+
+items = redis.call('LRANGE', KEYS[1], 0, ARGV[1] - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+
+def order_status_key(order_id, user_id):
+    return 'order_status_%s_%s' % (user_id, order_id)
+
+
+def dump_order(order_id, user, addr, pay_method, counts, reserved):
+    """生成订单记录"""
+    return json.dumps({'order_id': order_id,
+                       'user_id': user.id,
+                       'addr_id': addr.id,
+                       'pay_method': int(pay_method),
+                       'counts': counts,
+                       'reserved': reserved})
+
+
+def enqueue_order(order_id, user, addr, pay_method, counts):
+    """排队下单: 将订单放入队列,订单状态记为等待写入"""
+    conn = get_redis_connection('default')
+    pl = conn.pipeline()
+    pl.rpush(ORDER_QUEUE_KEY, dump_order(order_id, user, addr, pay_method, counts, False))
+    pl.set(order_status_key(order_id, user.id), ORDER_PENDING, ex=settings.ORDER_STATUS_TIMEOUT)
+    pl.execute()
+
+
+def pop_orders():
+    """取出一批订单记录,处理完成后需调用 ack_orders"""
+    conn = get_redis_connection('default')
+    items = conn.register_script(POP_SCRIPT)(keys=[ORDER_QUEUE_KEY, ORDER_PROCESSING_KEY],
+                                             args=[settings.ORDER_QUEUE_BATCH])
+    orders = []
+    for item in items:
+        order = json.loads(item.decode())
+        # json 的键只能是字符串
+        order['counts'] = {int(sku_id): count for sku_id, count in order['counts'].items()}
+        orders.append(order)
+    return orders
+
+
+def ack_orders():
+    """当前批次的订单处理完成"""
+    conn = get_redis_connection('default')
+    conn.delete(ORDER_PROCESSING_KEY)
+
+
+def set_order_status(orders, status):
+    """
+    记录一批订单的状态
+    orders: [(订单编号, 用户id), ...]
+    """
+    if not orders:
+        return
+    conn = get_redis_connection('default')
+    pl = conn.pipeline(transaction=False)
+    for order_id, user_id in orders:
+        pl.set(order_status_key(order_id, user_id), status, ex=settings.ORDER_STATUS_TIMEOUT)
+    pl.execute()
+
+
+def get_order_status(order_id, user_id):
+    """获取用户订单的状态,没有记录(包括订单不属于该用户)时返回 None"""
+    conn = get_redis_connection('default')
+    status = conn.get(order_status_key(order_id, user_id))
+    return status.decode() if status is not None else None
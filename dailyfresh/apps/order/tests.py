@@ -1,3 +1,179 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from django_redis import get_redis_connection
+from unittest import mock
+from utils import snowflake as snowflake_module
+from utils.snowflake import Snowflake, id_time, EPOCH, MAX_SEQUENCE, SEQUENCE_BITS, WORKER_BITS, LEASE_KEY
+from order.commit import make_order_id
+from order.expiry import pay_deadline, is_snowflake_order_id
+from django.utils import timezone
+from datetime import datetime
 
 # Create your tests here.
+
+# 使用单独的 redis 数据库,每个测试前后清空
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/15",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    }
+}
+
+
+class FakeTime(object):
+    """可控制的时钟,以微秒计时避免浮点误差,sleep 时时钟前进"""
+    def __init__(self, millis):
+        self.micros = millis * 1000
+        self.sleeps = 0
+
+    def time(self):
+        return self.micros / 1000000.0
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        self.micros += max(1, int(seconds * 1000000))
+
+    def set_millis(self, millis):
+        self.micros = millis * 1000
+
+
+def split_id(snowflake_id):
+    """拆分为 (毫秒时间戳, 机器号, 序列号)"""
+    return ((snowflake_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH,
+            (snowflake_id >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1),
+            snowflake_id & MAX_SEQUENCE)
+
+
+class SnowflakeTest(SimpleTestCase):
+    """雪花算法 id,固定机器号,不访问 redis"""
+    NOW = 1700000000000
+
+    def setUp(self):
+        self.clock = FakeTime(self.NOW)
+        patcher = mock.patch.object(snowflake_module, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.snowflake = Snowflake(worker_id=3)
+
+    def test_increasing_within_millisecond(self):
+        ids = [self.snowflake.next_id() for i in range(100)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual([split_id(i) for i in ids], [(self.NOW, 3, sequence) for sequence in range(100)])
+
+    def test_sequence_rollover_waits(self):
+        """同一毫秒内的序列号用完时等待到下一毫秒"""
+        ids = [self.snowflake.next_id() for i in range(MAX_SEQUENCE + 1)]
+        self.assertEqual(self.clock.sleeps, 0)
+
+        next_id = self.snowflake.next_id()
+        self.assertGreater(self.clock.sleeps, 0)
+        self.assertEqual(split_id(next_id), (self.NOW + 1, 3, 0))
+        self.assertGreater(next_id, ids[-1])
+        # 时钟确实到达了下一毫秒,没有借用未来的时间
+        self.assertGreaterEqual(int(self.clock.time() * 1000), self.NOW + 1)
+
+    def test_clock_backwards(self):
+        """时钟回拨时继续使用上一次的时间戳,保证单调递增"""
+        first = self.snowflake.next_id()
+        self.clock.set_millis(self.NOW - 1000)
+        second = self.snowflake.next_id()
+        self.assertGreater(second, first)
+        self.assertEqual(split_id(second), (self.NOW, 3, 1))
+
+        # 回拨较多时序列号用完不等待时钟追上,借用下一毫秒
+        self.snowflake._sequence = MAX_SEQUENCE
+        third = self.snowflake.next_id()
+        self.assertEqual(self.clock.sleeps, 0)
+        self.assertEqual(split_id(third), (self.NOW + 1, 3, 0))
+
+        # 时钟恢复后使用新的时间戳
+        self.clock.set_millis(self.NOW + 5)
+        self.assertEqual(split_id(self.snowflake.next_id()), (self.NOW + 5, 3, 0))
+
+    def test_id_time(self):
+        self.assertEqual(id_time(self.snowflake.next_id()), self.NOW / 1000.0)
+        self.clock.set_millis(self.NOW + 1234)
+        self.assertEqual(id_time(str(self.snowflake.next_id())), (self.NOW + 1234) / 1000.0)
+
+    @override_settings(SNOWFLAKE_WORKER_ID=5)
+    def test_make_order_id(self):
+        """订单编号为 20 位数字,字符串顺序与生成顺序一致"""
+        with mock.patch('order.commit.snowflake', Snowflake()):
+            order_ids = [make_order_id() for i in range(10)]
+        for order_id in order_ids:
+            self.assertEqual(len(order_id), 20)
+            self.assertTrue(order_id.isdigit())
+            self.assertEqual(id_time(order_id), self.NOW / 1000.0)
+        self.assertEqual(order_ids, sorted(set(order_ids)))
+
+
+@override_settings(CACHES=TEST_CACHES, SNOWFLAKE_WORKER_ID=None)
+class SnowflakeLeaseTest(SimpleTestCase):
+    """机器号租约,使用测试 redis 数据库,不启动续期线程"""
+
+    def setUp(self):
+        self.conn = get_redis_connection('default')
+        self.conn.flushdb()
+        self.addCleanup(self.conn.flushdb)
+        patcher = mock.patch.object(snowflake_module.threading, 'Thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.snowflake = Snowflake()
+        self.snowflake.next_id()
+        self.key = LEASE_KEY % self.snowflake._worker_id
+
+    def test_allocate(self):
+        self.assertEqual(self.conn.get(self.key).decode(), self.snowflake._token)
+        self.assertGreater(self.conn.ttl(self.key), 0)
+
+        # 已被占用的机器号不会分配给其他进程
+        other = Snowflake()
+        other.next_id()
+        self.assertNotEqual(other._worker_id, self.snowflake._worker_id)
+
+    def test_renew(self):
+        self.conn.expire(self.key, 5)
+        self.snowflake._lease_until = 0
+        self.assertTrue(self.snowflake._renew(self.snowflake._worker_id, self.snowflake._token))
+        self.assertGreater(self.conn.ttl(self.key), 5)
+        self.assertGreater(self.snowflake._lease_until, 0)
+
+    def test_renew_lost(self):
+        """租约被其他进程占用后不再续期,下次生成 id 时重新分配机器号"""
+        worker_id = self.snowflake._worker_id
+        self.conn.set(self.key, 'other')
+        self.assertFalse(self.snowflake._renew(worker_id, self.snowflake._token))
+        self.assertEqual(self.conn.get(self.key), b'other')
+
+        self.snowflake.next_id()
+        self.assertNotEqual(self.snowflake._worker_id, worker_id)
+
+    def test_release(self):
+        self.snowflake._release()
+        self.assertFalse(self.conn.exists(self.key))
+
+    def test_release_others(self):
+        """不释放其他进程持有的租约"""
+        self.conn.set(self.key, 'other')
+        self.snowflake._release()
+        self.assertEqual(self.conn.get(self.key), b'other')
+
+
+class PayDeadlineTest(SimpleTestCase):
+    """支付截止时间"""
+
+    def test_snowflake_order_id(self):
+        order_id = '%020d' % Snowflake(worker_id=1).next_id()
+        self.assertTrue(is_snowflake_order_id(order_id))
+        self.assertEqual(pay_deadline(order_id), id_time(order_id) + settings.ORDER_PAY_TIMEOUT)
+
+    def test_legacy_order_id(self):
+        """旧版本的订单编号(下单时间 + 用户 id)使用订单的创建时间"""
+        create_time = datetime(2019, 5, 30, 9, 5, 15, tzinfo=timezone.utc)
+        for order_id in ('201905301705155923590012', '20190530170515123456'):
+            self.assertFalse(is_snowflake_order_id(order_id))
+            self.assertEqual(pay_deadline(order_id, create_time),
+                             create_time.timestamp() + settings.ORDER_PAY_TIMEOUT)
@@ -1,11 +1,18 @@
+from django.conf import settings
 from django.conf.urls import url
-from order.views import OrderPlaceView, OrderCommitView, OrderPayView, OrderCheckView, OrderCommentView
+from order.views import OrderPlaceView, OrderCommitView, OrderStatusView, OrderPayView, OrderCheckView, OrderNotifyView, FakeGatewayView, OrderCommentView
 
 urlpatterns = [
     url(r'^place$', OrderPlaceView.as_view(), name='place'),  # 订单显示页面
     url(r'^commit$', OrderCommitView.as_view(), name='commit'),  # 订单提交页面
+    url(r'^status$', OrderStatusView.as_view(), name='status'),  # 订单状态查询
     url(r'^pay$', OrderPayView.as_view(), name='pay'),  # 订单支付界面
     url(r'^check$', OrderCheckView.as_view(), name='check'),  # 支付确认
+    url(r'^notify$', OrderNotifyView.as_view(), name='notify'),  # 支付宝异步通知
     url(r'^comment/(?P<order_id>.+)$', OrderCommentView.as_view(), name='comment'),  # 订单评论页
 
-]
\ No newline at end of file
+]
+
+# 本地模拟的支付宝支付页面,只在开发和测试时使用
+if settings.ALIPAY_FAKE:
+    urlpatterns.append(url(r'^fake_gateway$', FakeGatewayView.as_view(), name='fake_gateway'))
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+import time
+
+
+# 用户历史浏览记录
+# 使用 redis 有序集合存储, browse_history_userid 用作键, sku_id 用作成员,浏览时间用作分数
+# 重复浏览同一商品时只更新分数,去重为 O(log n),不再需要 list 的 O(n) lrem
+# 只保留用户中心展示的 HISTORY_LENGTH 条记录,并在每次浏览时刷新过期时间,长时间不活跃用户的记录自动过期
+# 旧版本使用 list 存储在 history_userid 中,由定时清理任务迁移到有序集合后删除
+
+# 旧版本 list 浏览记录的键
+LEGACY_HISTORY_PATTERN = 'history_*'
+
+# 迁移旧版本浏览记录
+# KEYS[1]: 旧版本 list(lpush 写入,最新浏览的在前), KEYS[2]: 有序集合
+# ARGV[1]: 保留的记录数, ARGV[2]: 过期时间, ARGV[3]: 当前时间
+# 旧记录早于有序集合中已有的记录,分数从已有记录的最小分数(没有时为当前时间)开始依次递减,
+# 使用 NX 不覆盖升级后浏览过的商品,迁移后删除 list,返回迁移的记录数
+MIGRATE_SCRIPT = """
+local length = tonumber(ARGV[1])
+local items = redis.call('LRANGE', KEYS[1], 0, length - 1)
+if #items > 0 then
+    local score = tonumber(ARGV[3])
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if #oldest > 0 then
+        score = math.min(score, tonumber(oldest[2]))
+    end
+    for i, sku_id in ipairs(items) do
+        redis.call('ZADD', KEYS[2], 'NX', score - i, sku_id)
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -length - 1)
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+
+def history_key(user_id):
+    return 'browse_history_%d' % user_id
+
+
+def add_history(pipeline, user_id, sku_id):
+    """添加浏览记录,命令放入 pipeline,由调用方统一发送"""
+    key = history_key(user_id)
+    # 已浏览过的商品只更新浏览时间
+    pipeline.zadd(key, {sku_id: time.time()})
+    # 只保留最新的 HISTORY_LENGTH 条记录,防止有序集合无限增长
+    pipeline.zremrangebyrank(key, 0, -settings.HISTORY_LENGTH - 1)
+    pipeline.expire(key, settings.HISTORY_TIMEOUT)
+
+
+def get_history(user_id):
+    """获取最近浏览的商品 id,最新浏览的在前"""
+    conn = get_redis_connection('default')
+    return [int(sku_id) for sku_id in conn.zrevrange(history_key(user_id), 0, settings.HISTORY_LENGTH - 1)]
+
+
+def migrate_legacy_history(conn, keys):
+    """将一批旧版本 list 浏览记录迁移到有序集合,键名不是 history_userid 的直接删除"""
+    migrate = conn.register_script(MIGRATE_SCRIPT)
+    pl = conn.pipeline(transaction=False)
+    invalid = []
+    for key in keys:
+        user_id = key.decode()[len('history_'):]
+        if not user_id.isdigit():
+            invalid.append(key)
+            continue
+        migrate(keys=[key, history_key(int(user_id))],
+                args=[settings.HISTORY_LENGTH, settings.HISTORY_TIMEOUT, time.time()],
+                client=pl)
+    if invalid:
+        pl.delete(*invalid)
+    pl.execute()
@@ -3,7 +3,6 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.views.generic import View
 from django.conf import settings
-from django_redis import get_redis_connection
 from django.http import JsonResponse
 
 from utils.mixin import LoginRequiredMixin
@@ -16,6 +15,8 @@ import re
 from user.models import User, Address
 from goods.models import GoodsSKU
 from order.models import OrderInfo, OrderGoods
+from cart.utils import cart_owner, merge_cart
+from user.history import get_history
 
 
 # user/register
@@ -142,9 +143,16 @@ class LoginView(View):
         if user is not None:
             # 已激活
             if user.is_active:
+                # 登录会更换 session id,需要在登录前取出未登录时的购物车
+                guest = cart_owner(request)
+
                 # 记录用户登录状态,将用户 sesion 存储在 redis 的 cache 里
                 login(request, user)
 
+                # 将未登录时添加的商品合并到用户的购物车
+                if guest is not None:
+                    merge_cart(guest, user.id)
+
                 # 由于 templates 里的 form 表格未设置 action 属性,
                 # 因此 form 里的数据会传递到地址栏里
                 # LoginRequire 装饰器,会在地址栏后面添加一个 next 参数,用于接收上一次的访问路径
@@ -213,24 +221,17 @@ class UserView(LoginRequiredMixin, View):
         # 答: 使用 redis 缓存的方式存储浏览记录,而不是使用 Mysql数据库,防止因操作数据库太频繁,导致数据库压力过大
         # 4. 使用什么类型存储浏览记录
         # 答: 两种思路: 1) 使用 hash 类型, history 当做属性,user_id 当做键值,sku_id 当做值,
-        #             2) 使用 list 类型, history_userid 当做键值,sku_id 当做值
-        #    由于将所有的浏览记录都存放在一个 hash 列表里,会导致数据冗余、繁杂,不易维护,所以使用 list 的方式为每个用户存储浏览记录
-
-        # 拼凑 redis 里历史浏览记录的键值
-        history_userid = 'history_%d' % user.id
-        # 获取用户历史浏览记录的前五条记录
-        con = get_redis_connection('default')
-
-        sku_ids = con.lrange(history_userid, 0, 4)
-
-        history_goods = []
+        #             2) 为每个用户单独存储浏览记录
+        #    由于将所有的浏览记录都存放在一个 hash 列表里,会导致数据冗余、繁杂,不易维护,所以为每个用户单独存储浏览记录,
+        #    使用有序集合,浏览时间当做分数,重复浏览时只需更新分数,见 user/history.py
 
-        # 由于 mysql 数据库在获取数据时,不是按照 id 号存储,只会按存储顺序存储
-        # 得将用户最新浏览的几个商品取出
+        # 获取用户最近浏览的商品 id,最新浏览的在前
+        sku_ids = get_history(user.id)
 
-        for sku_id in sku_ids:
-            goods = GoodsSKU.objects.get(id=sku_id).order_by('-create_time')
-            history_goods.append(goods)
+        # 一次查询取出所有商品,in_bulk 返回的字典没有顺序,按浏览记录的顺序排列
+        # 已被删除的商品跳过
+        skus = GoodsSKU.objects.in_bulk(sku_ids)
+        history_goods = [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
 
         content = {'page': page,
                    'user': user,
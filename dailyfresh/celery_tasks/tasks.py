@@ -1,16 +1,61 @@
 # 使用 celery 来发送邮件,减少用户等待时间
-from celery import Celery
+from celery import Celery, group
+from celery.schedules import crontab
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template import loader, RequestContext
 from django.shortcuts import render
-from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from django_redis import get_redis_connection
+from goods.models import GoodsType, GoodsSKU
+from goods.index import get_index_data, get_goods_types
+from goods.pages import get_detail_context, get_list_context, LIST_SORTS
+from goods.static_pages import mark_all_static_dirty, pop_static_dirty
+from user.history import LEGACY_HISTORY_PATTERN, migrate_legacy_history
+from order.queue import pop_orders, ack_orders, set_order_status, ORDER_CREATED, ORDER_FAILED
+from order.commit import persist_orders
+from order.payment import due_payments, postpone_payments, check_payment, mark_failed
+from order.expiry import due_orders, cancel_orders
+from utils.snowflake import RELEASE_SCRIPT
+import hashlib
+import tempfile
+import shutil
+import uuid
+import time
 import os
 
 
 # 创建一个 celery 实例对象
 app = Celery('celery_tasks.tasks', broker='redis://127.0.0.1:6379/3')  # broker 设置中间人,使用 redis 作为中间人
 
+# 定时任务,需要启动 celery beat: celery -A celery_tasks.tasks beat
+app.conf.beat_schedule = {
+    # 每天凌晨清理 redis 中不活跃用户的购物车、浏览记录
+    'compact-user-keys': {
+        'task': 'celery_tasks.tasks.compact_user_keys',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    # 生成被标记的详情页、列表页静态页面,下单、评论等不经过 admin 的修改也会在该间隔内更新到静态页面
+    'generate-static-pages': {
+        'task': 'celery_tasks.tasks.generate_static_pages',
+        'schedule': settings.STATIC_PAGES_INTERVAL,
+    },
+    # 分批查询等待确认的支付结果
+    'poll-pending-payments': {
+        'task': 'celery_tasks.tasks.poll_pending_payments',
+        'schedule': settings.PAY_POLL_INTERVAL,
+    },
+    # 分批取消超时未支付的订单
+    'expire-unpaid-orders': {
+        'task': 'celery_tasks.tasks.expire_unpaid_orders',
+        'schedule': settings.ORDER_EXPIRY_INTERVAL,
+    },
+    # 兜底写入订单队列,防止触发的任务丢失、任务中断时订单滞留在队列中
+    'persist-order-queue': {
+        'task': 'celery_tasks.tasks.persist_order_queue',
+        'schedule': 60,
+    },
+}
+
 
 @app.task  # 使用 celery 下的 task 函数对任务函数进行装饰
 def send_active_email(to_email, userName, token):
@@ -24,6 +69,61 @@ def send_active_email(to_email, userName, token):
     send_mail(subject, message, sender, receiver, html_message=html_message)
 
 
+def write_static_file(save_path, html):
+    """
+    写入静态页面
+    先写入同目录下的临时文件,再通过 os.replace 原子替换,防止 Nginx 读到只写了一半的文件
+    内容与现有文件一致时不写入,返回是否发生写入
+    """
+    html = html.encode('utf-8')
+
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+    if os.path.exists(save_path):
+        with open(save_path, 'rb') as f:
+            if hashlib.md5(f.read()).hexdigest() == hashlib.md5(html).hexdigest():
+                return False
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(save_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(html)
+        # mkstemp 创建的文件只有属主可读,修改权限使 Nginx 可以读取
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, save_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return True
+
+
+def _schedule_once(marker, task, countdown):
+    """
+    防抖触发任务
+    在 redis 里使用 set nx 设置一个带过期时间的标记,标记存在期间的多次触发只会发出一个延时任务,
+    如批量修改数据时,只会生成一次静态页面,任务开始执行时删除该标记
+    """
+    conn = get_redis_connection('default')
+    if conn.set(marker, 1, nx=True, ex=countdown * 2):
+        task.apply_async(countdown=countdown)
+
+
+def schedule_static_index():
+    """防抖触发首页静态页面的生成"""
+    _schedule_once('static_index_pending', generate_static_index, settings.STATIC_INDEX_DEBOUNCE)
+
+
+def schedule_static_pages():
+    """防抖触发详情页、列表页静态页面的生成"""
+    _schedule_once('static_pages_pending', generate_static_pages, settings.STATIC_INDEX_DEBOUNCE)
+
+
+def schedule_order_queue():
+    """订单放入订单队列后,防抖触发订单的写入,同一时间段内的订单一起写入数据库"""
+    _schedule_once('order_queue_pending', persist_order_queue, settings.ORDER_QUEUE_DELAY)
+
+
 @app.task
 def generate_static_index():
     """生成首页静态页面"""
@@ -34,32 +134,15 @@ def generate_static_index():
     # 4. 当用户访问 127.0.0.1 时,未加端口号,默认访问 80 端口,
     # 5. 完成首页静态页面优化
 
+    # 开始生成前清除防抖标记,生成期间的修改会再触发一次生成,保证页面是最新的
+    conn = get_redis_connection('default')
+    conn.delete('static_index_pending')
+
     # 获取模板
     template = loader.get_template('static_index.html')
 
-    # 组织上下文
-
-    # 获取商品种类信息
-    goods_type = GoodsType.objects.all()
-    # 获取首页轮播图的信息
-    goods_banner = IndexGoodsBanner.objects.all().order_by('index')  # order_by() 根据传来的参数进行排序
-    # 获取首页广告的信息
-    ad_banner = IndexPromotionBanner.objects.all().order_by('index')
-
-    # 获取首页商品展示信息
-    # 通过给 type 添加属性,解决展示区域内既有文字有有图片的问题
-    for type in goods_type:
-        image_banner = IndexTypeGoodsBanner.objects.filter(type=type, display_type=1)
-        title_banner = IndexTypeGoodsBanner.objects.filter(type=type, display_type=0)
-
-        # 动态添加 type 两个属性,防止商品展示区域由于展示的既有图片也有文字而导致模板编写过于复杂
-        type.image_banners = image_banner
-        type.title_banners = title_banner
-
-    content = {'goods_type': goods_type,
-               'goods_banner': goods_banner,
-               'ad_banner': ad_banner,
-               }
+    # 组织上下文,与首页视图共用首页数据组装函数,生成静态页面时不读取缓存
+    content = get_index_data(use_cache=False)
 
     # 定义上下文
     # 可以直接将变量传给模板文件,不需要 request ,不需要定义上下文
@@ -70,7 +153,265 @@ def generate_static_index():
 
     save_path = os.path.join(settings.BASE_DIR, 'static/index.html')
 
-    # 将得到的模板文件,写入 static 下的 index.html 文件中
-    with open(save_path, 'w') as f:
-        f.write(static_index_html)
+    # 将得到的模板文件,写入 static 下的 index.html 文件中,内容未变化时跳过写入
+    write_static_file(save_path, static_index_html)
+
+
+def _detail_path(sku_id):
+    return os.path.join(settings.BASE_DIR, 'static/detail/%s.html' % sku_id)
+
+
+def _list_path(type_id, sort, page):
+    return os.path.join(settings.BASE_DIR, 'static/list/%s/%s_%d.html' % (type_id, sort, page))
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+@app.task
+def generate_static_pages():
+    """
+    生成详情页和列表页静态页面
+    静态页面保存在 static/detail/sku_id.html 和 static/list/type_id/sort_page.html,
+    Nginx 对未登录用户直接返回静态页面,不再经过 Django
+
+    数据发生变化时受影响的页面被标记(见 goods/static_pages.py),这里只重新生成被标记的页面,
+    需要生成的页面按块分发给多个 celery worker 并行生成
+    """
+    conn = get_redis_connection('default')
+    conn.delete('static_pages_pending')
+
+    # 第一次生成(或 redis 清空后)时生成所有页面
+    if conn.set('static_pages_initialized', 1, nx=True):
+        mark_all_static_dirty()
+
+    sku_ids, type_ids = pop_static_dirty()
+
+    # 删除已下架商品的静态页面
+    existing = set(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', flat=True))
+    for sku_id in sku_ids:
+        if sku_id not in existing and os.path.exists(_detail_path(sku_id)):
+            os.remove(_detail_path(sku_id))
+
+    # 分块后发给多个 worker 并行生成
+    tasks = [generate_static_details.s(chunk) for chunk in _chunks(sorted(existing), settings.STATIC_PAGES_CHUNK)]
+    tasks += [generate_static_lists.s(chunk) for chunk in _chunks(type_ids, settings.STATIC_PAGES_CHUNK)]
+    if tasks:
+        group(tasks).apply_async()
+
+
+@app.task
+def generate_static_details(sku_ids):
+    """生成一块商品的详情页静态页面"""
+    template = loader.get_template('detail.html')
+
+    for sku_id in sku_ids:
+        try:
+            # 生成静态页面时不读取缓存
+            content = get_detail_context(sku_id, use_cache=False)
+        except GoodsSKU.DoesNotExist:
+            # 商品在分发任务后被删除,删除信号会再次标记该页面
+            continue
+        # 静态页面只提供给未登录用户,购物车数目由页面通过 ajax 获取
+        content.update({'cart_count': 0, 'static_page': True})
+        write_static_file(_detail_path(sku_id), template.render(content))
+
+
+@app.task
+def generate_static_lists(type_ids):
+    """生成一块商品种类的列表页静态页面,每种排序方式只生成前 STATIC_LIST_PAGES 页,已删除种类的页面被删除"""
+    template = loader.get_template('list.html')
+
+    goods_types = {goods_type['id']: goods_type for goods_type in get_goods_types()}
+    for type_id in type_ids:
+        goods_type = goods_types.get(type_id)
+        if goods_type is None:
+            shutil.rmtree(os.path.dirname(_list_path(type_id, 'default', 1)), ignore_errors=True)
+            continue
+
+        for sort in LIST_SORTS:
+            page = 1
+            while True:
+                content = get_list_context(goods_type, page, sort)
+                content.update({'cart_count': 0, 'static_page': True})
+                write_static_file(_list_path(type_id, sort, page), template.render(content))
+
+                page += 1
+                if page > settings.STATIC_LIST_PAGES or not content['has_next']:
+                    break
+
+
+def _compact_keys(conn, keys, timeout):
+    """
+    处理一批键: 没有过期时间的键(过期时间功能上线前产生的)设置过期时间
+    返回设置了过期时间的键数目
+    """
+    pl = conn.pipeline(transaction=False)
+    for key in keys:
+        pl.ttl(key)
+    ttls = pl.execute()
+
+    expired = 0
+    for key, ttl in zip(keys, ttls):
+        # ttl 为 -1 表示键存在但没有过期时间,为 -2 表示键已不存在
+        if ttl == -1:
+            pl.expire(key, timeout)
+            expired += 1
+    pl.execute()
+
+    return expired
+
+
+def _scan_batches(conn, pattern):
+    """使用 scan 分批遍历键,不会像 keys 命令一样长时间阻塞 redis"""
+    batch_size = settings.COMPACT_BATCH_SIZE
+    keys = []
+    for key in conn.scan_iter(match=pattern, count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            yield keys
+            keys = []
+    if keys:
+        yield keys
+
+
+@app.task
+def compact_user_keys():
+    """
+    定时清理 redis 中的购物车、浏览记录,每批键的命令通过 pipeline 一次发送
+    正常访问时会刷新过期时间,这里只需要处理没有过期时间的旧数据,不活跃用户的数据随后自动过期
+    """
+    conn = get_redis_connection('default')
+
+    expired = 0
+    # cart_* 同时匹配购物车(cart_id, cart_guest_id)和购物车商品总数(cart_count_id)
+    for pattern, timeout in (('cart_*', settings.CART_TIMEOUT),
+                             ('browse_history_*', settings.HISTORY_TIMEOUT)):
+        for keys in _scan_batches(conn, pattern):
+            expired += _compact_keys(conn, keys, timeout)
+
+    # 旧版本使用 list 存储的浏览记录迁移到有序集合后删除
+    for keys in _scan_batches(conn, LEGACY_HISTORY_PATTERN):
+        migrate_legacy_history(conn, keys)
+
+    return expired
+
+
+# 定时任务的互斥锁
+# 锁的值为随机生成的持有者标识,释放时只删除自己持有的锁,任务超过锁的有效期后不会删除其他任务的锁
+# 每次执行最多处理 TASK_TIME_LIMIT 秒,远小于锁的有效期,剩余的数据由下一次执行处理
+TASK_LOCK_TIMEOUT = 300
+TASK_TIME_LIMIT = 60
+
+
+def _acquire_lock(conn, lock):
+    """获取锁,返回持有者标识,锁已被其他任务持有时返回 None"""
+    token = uuid.uuid4().hex
+    if conn.set(lock, token, nx=True, ex=TASK_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_lock(conn, lock, token):
+    conn.register_script(RELEASE_SCRIPT)(keys=[lock], args=[token])
+
+
+@app.task
+def persist_order_queue():
+    """
+    分批将订单队列中的订单写入数据库,直到队列为空或达到执行时间上限,达到上限时触发下一次写入
+    每批订单中同一商品只上锁、扣减库存一次,写入失败的订单状态记为失败
+    """
+    conn = get_redis_connection('default')
+    conn.delete('order_queue_pending')
+
+    # 同一时间只允许一个任务写入,防止两个任务处理同一批订单
+    token = _acquire_lock(conn, 'order_queue_lock')
+    if token is None:
+        return
+
+    deadline = time.time() + TASK_TIME_LIMIT
+    try:
+        while True:
+            if time.time() >= deadline:
+                schedule_order_queue()
+                break
+
+            orders = pop_orders()
+            if not orders:
+                break
+
+            created, failed = persist_orders(orders)
+            users = {order['order_id']: order['user_id'] for order in orders}
+            set_order_status([(order_id, users[order_id]) for order_id in created], ORDER_CREATED)
+            set_order_status([(order_id, users[order_id]) for order_id in failed], ORDER_FAILED)
+            ack_orders()
+    finally:
+        _release_lock(conn, 'order_queue_lock', token)
+
+
+@app.task
+def poll_pending_payments():
+    """
+    分批查询到达查询时间的订单的支付结果,直到没有到期的订单或达到执行时间上限
+    尚未付款的订单按指数退避推迟下次查询,超过最多查询次数的订单记为支付失败
+    达到上限时还未查询的订单仍在到期集合中,由下一次执行查询
+    """
+    conn = get_redis_connection('default')
+
+    # 同一时间只允许一个任务查询
+    token = _acquire_lock(conn, 'pay_poll_lock')
+    if token is None:
+        return
+
+    deadline = time.time() + TASK_TIME_LIMIT
+    try:
+        while time.time() < deadline:
+            order_ids = due_payments()
+            if not order_ids:
+                break
+
+            waiting = []
+            for order_id in order_ids:
+                # 每次查询都需要请求支付宝,一批中途也检查时间
+                if time.time() >= deadline:
+                    break
+                try:
+                    done = check_payment(order_id)
+                except Exception:
+                    # 网络错误等,稍后重试
+                    done = False
+                if not done:
+                    waiting.append(order_id)
+
+            for order_id in postpone_payments(waiting):
+                mark_failed(order_id)
+    finally:
+        _release_lock(conn, 'pay_poll_lock', token)
+
+
+@app.task
+def expire_unpaid_orders():
+    """
+    分批取消超过支付截止时间的订单并归还库存,直到没有到期的订单或达到执行时间上限
+    取消的订单停止查询支付结果,支付状态记为失败
+    """
+    conn = get_redis_connection('default')
+
+    # 同一时间只允许一个任务取消
+    token = _acquire_lock(conn, 'order_expiry_lock')
+    if token is None:
+        return
+
+    deadline = time.time() + TASK_TIME_LIMIT
+    try:
+        while time.time() < deadline:
+            order_ids = due_orders()
+            if not order_ids:
+                break
 
+            for order_id in cancel_orders(order_ids):
+                mark_failed(order_id)
+    finally:
+        _release_lock(conn, 'order_expiry_lock', token)
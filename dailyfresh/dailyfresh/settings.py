@@ -60,6 +60,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'utils.middleware.RedisPipelineMiddleware',  # 执行请求中未执行的 redis 命令
+    'utils.middleware.AfterCommitMiddleware',  # 事务提交后再次使缓存失效
 )
 
 ROOT_URLCONF = 'dailyfresh.urls'
@@ -75,6 +77,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart_count',  # 页面头部的购物车数目
             ],
         },
     },
@@ -166,6 +169,93 @@ CLIENT_CONF = './utils/fdfs/client.conf'
 # nginx 的默认域名和端口号
 FDFS_PATH = 'http://192.168.1.5:8888/'
 
+# 进程内缓存的最大条目数和过期时间(秒),用于缓存商品种类等基础数据
+LOCAL_CACHE_MAXSIZE = 256
+LOCAL_CACHE_TIMEOUT = 300
+
+# 列表页每页显示的商品数目
+LIST_PAGE_SIZE = 10
+
+# 购物车的过期时间(秒),每次访问购物车时刷新
+CART_TIMEOUT = 90 * 24 * 3600
+# 未登录用户购物车的过期时间(秒)
+GUEST_CART_TIMEOUT = 7 * 24 * 3600
+
+# 用户中心展示的历史浏览记录条数,redis 中只保留这些记录
+HISTORY_LENGTH = 5
+# 历史浏览记录的过期时间(秒),每次浏览商品时刷新
+HISTORY_TIMEOUT = 30 * 24 * 3600
+
+# 定时清理任务中,每次 scan 和批量处理的键数目
+COMPACT_BATCH_SIZE = 500
+
+# 订单编号生成器(雪花算法)的机器号 0 ~ 1023,为 None 时通过 redis 租约为每个进程自动分配
+# 只有每台机器只运行一个下单进程时才可以手动指定,否则同一机器的多个进程会生成重复的 id
+SNOWFLAKE_WORKER_ID = None
+# 机器号租约的过期时间(秒),进程每隔三分之一的时间续期一次
+SNOWFLAKE_LEASE_TIMEOUT = 60
+
+# 订单提交方式: pessimistic(悲观锁,select ... for update), optimistic(乐观锁,带条件的 update)
+ORDER_COMMIT_MODE = 'pessimistic'
+# 乐观锁提交订单遇到死锁、锁等待超时时的最多重试次数
+ORDER_COMMIT_RETRIES = 3
+# 乐观锁重试的退避基数(秒),第 n 次重试前随机等待 0 ~ ORDER_COMMIT_BACKOFF * 2^n 秒
+ORDER_COMMIT_BACKOFF = 0.01
+
+# 是否排队下单: 为 True 时订单只放入 redis 订单队列后立即返回,由 celery 任务分批写入数据库
+ORDER_COMMIT_QUEUED = False
+# 订单放入订单队列(排队下单、秒杀)后,延迟多少秒写入数据库,期间的订单一起写入
+ORDER_QUEUE_DELAY = 1
+# 每批写入数据库的订单数
+ORDER_QUEUE_BATCH = 200
+# redis 中订单状态(等待写入、已创建、失败)的保存时间(秒)
+ORDER_STATUS_TIMEOUT = 24 * 3600
+
+# 需要在线支付的订单的支付时限(秒),超时未支付的订单自动取消并归还库存
+ORDER_PAY_TIMEOUT = 30 * 60
+# 检查超时订单的间隔(秒)
+ORDER_EXPIRY_INTERVAL = 30
+# 每批取消的订单数
+ORDER_EXPIRY_BATCH = 500
+
+# 支付宝
+ALIPAY_APPID = '2016101100657939'
+# 应用私钥、支付宝公钥的路径
+ALIPAY_APP_PRIVATE_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/app_private_key.pem')
+ALIPAY_PUBLIC_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/alipay_public_key.pem')
+# 为 True 时访问沙箱环境
+ALIPAY_DEBUG = True
+# 支付网关,沙箱环境的 url 为 alipaydev
+ALIPAY_GATEWAY = 'https://openapi.alipaydev.com/gateway.do'
+# 接收支付宝异步通知的地址,需要能从外网访问
+ALIPAY_NOTIFY_URL = 'http://127.0.0.1:8000/order/notify'
+# 为 True 时使用本地模拟的支付宝网关(order/fake_alipay.py),用于开发和测试
+ALIPAY_FAKE = False
+if ALIPAY_FAKE:
+    ALIPAY_GATEWAY = '/order/fake_gateway'
+
+# 定时查询支付结果的间隔(秒),也是第一次查询前的等待时间
+PAY_POLL_INTERVAL = 5
+# 未付款时推迟下次查询的最长间隔(秒)
+PAY_POLL_MAX_INTERVAL = 300
+# 每个订单最多查询的次数
+PAY_POLL_MAX_ATTEMPTS = 20
+# 每批查询的订单数
+PAY_POLL_BATCH = 100
+
+# 批量修改购物车时一次请求最多包含的操作数
+CART_BATCH_LIMIT = 100
+
+# 静态页面生成的防抖时间(秒),该时间内的多次后台修改只生成一次静态页面
+STATIC_INDEX_DEBOUNCE = 10
+
+# 详情页、列表页静态页面生成时,每个 celery 任务处理的页面块大小
+STATIC_PAGES_CHUNK = 50
+# 列表页每种排序方式生成静态页面的页数
+STATIC_LIST_PAGES = 3
+# 定时检查并生成详情页、列表页静态页面的间隔(秒),下单、评论后的页面在该间隔内更新
+STATIC_PAGES_INTERVAL = 60
+
 # 全文检索框架的配置
 HAYSTACK_CONNECTIONS = {
     'default': {
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+import time
+
+
+def incr_version(key):
+    """缓存版本号 + 1,版本号不存在时 incr 会报错,此时直接设置版本号,版本号永不过期"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+def get_or_build(key, builder, timeout, lock_timeout=10):
+    """
+    带击穿保护的缓存读取
+    缓存内容为 (逻辑过期时间, 数据),实际过期时间为 timeout 的两倍
+    1. 未逻辑过期时,直接返回数据
+    2. 逻辑过期后,只有抢到锁的进程重建缓存,其他进程继续返回旧数据
+    3. 没有任何缓存时,抢不到锁的进程等待其他进程重建完成,等待超时后自己重建
+    """
+    lock_key = '%s_lock' % key
+    entry = cache.get(key)
+
+    # cache.add 只在键不存在时设置成功,用作分布式锁
+    if entry is not None:
+        expire_at, data = entry
+        if expire_at > time.time():
+            return data
+        locked = cache.add(lock_key, 1, lock_timeout)
+        if not locked:
+            return data
+    else:
+        locked = cache.add(lock_key, 1, lock_timeout)
+        if not locked:
+            for i in range(20):
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None:
+                    return entry[1]
+
+    try:
+        data = builder()
+        cache.set(key, (time.time() + timeout, data), timeout * 2)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    return data
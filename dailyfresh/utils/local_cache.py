@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from django.conf import settings
+from django_redis import get_redis_connection
+import threading
+import time
+import os
+
+
+# 进程内缓存
+# 商品种类等几乎不变的基础数据,每个请求都会用到,缓存在进程内存中,连 redis 也不必访问
+# 缓存有过期时间(TTL),并限制最大条目数(LRU 淘汰最久未使用的数据),防止占用过多内存
+# 后台修改数据时,通过 redis 的发布订阅通知所有 web 进程删除对应的缓存
+
+# 缓存失效通知的频道
+INVALIDATE_CHANNEL = 'local_cache_invalidate'
+
+
+class LocalCache(object):
+    """线程安全的进程内 TTL + LRU 缓存"""
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # 监听失效通知的进程 id,uwsgi 会在导入项目后 fork 出工作进程,监听线程需要在每个工作进程中单独启动
+        self._listener_pid = None
+
+    def get(self, key, builder):
+        """读取缓存,缓存不存在或已过期时调用 builder 生成数据"""
+        self._ensure_listener()
+
+        now = time.time()
+        with self._lock:
+            if key in self._data:
+                expire_at, value = self._data[key]
+                if expire_at > now:
+                    # 最近使用的数据移动到末尾
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+
+        value = builder()
+
+        with self._lock:
+            self._data[key] = (now + self.timeout, value)
+            self._data.move_to_end(key)
+            # 超过最大条目数时,淘汰最久未使用的数据
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+        return value
+
+    def delete(self, key):
+        """只删除当前进程的缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, key):
+        """删除所有进程的缓存"""
+        self.delete(key)
+        conn = get_redis_connection('default')
+        conn.publish(INVALIDATE_CHANNEL, key)
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            # fork 之前的缓存可能已经过时,清空后重新读取
+            self._data.clear()
+        thread = threading.Thread(target=self._listen, daemon=True)
+        thread.start()
+
+    def _listen(self):
+        """订阅失效通知,连接断开后重连,期间的数据由过期时间兜底"""
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                # 重新连接期间可能错过了失效通知,清空缓存
+                with self._lock:
+                    self._data.clear()
+                for message in pubsub.listen():
+                    self.delete(message['data'].decode())
+            except Exception as e:
+                time.sleep(1)
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAXSIZE, settings.LOCAL_CACHE_TIMEOUT)
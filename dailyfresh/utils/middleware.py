@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from django.db import transaction
+from django_redis import get_redis_connection
+import threading
+
+
+# 请求结束后需要再次执行的缓存失效操作
+_after_commit = threading.local()
+
+
+def get_request_pipeline(request):
+    """
+    获取当前请求的 redis pipeline
+    一个请求内需要执行的多条 redis 命令(如添加浏览记录、获取购物车数目)先放入 pipeline,
+    最后一次性发送给 redis,整个页面只需要一次网络往返
+    """
+    if not hasattr(request, 'redis_pipeline'):
+        request.redis_pipeline = get_redis_connection('default').pipeline(transaction=False)
+    return request.redis_pipeline
+
+
+class RedisPipelineMiddleware(object):
+    """返回应答前,执行请求中尚未执行的 redis 命令,防止模板未使用购物车数目时命令丢失"""
+    def process_response(self, request, response):
+        pipeline = getattr(request, 'redis_pipeline', None)
+        if pipeline is not None and len(pipeline):
+            pipeline.execute()
+        return response
+
+
+def repeat_after_commit(func, *args):
+    """
+    立即执行缓存失效操作 func(*args),在请求中且处于事务中时,请求结束后(事务已提交)再执行一次
+    Django 1.8 没有 transaction.on_commit,admin 的修改在 atomic 中进行,信号发出时数据尚未提交,
+    期间其他请求可能用旧数据重建缓存并保存在新的版本号下,需要在提交后再失效一次
+    同一请求中相同的操作只重复执行一次
+    celery 任务、管理命令等不经过中间件,只立即执行,不登记,防止登记的操作堆积在线程中永远不会执行
+    """
+    func(*args)
+    callbacks = getattr(_after_commit, 'callbacks', None)
+    if callbacks is not None and transaction.get_connection().in_atomic_block:
+        callbacks[(func, args)] = None
+
+
+class AfterCommitMiddleware(object):
+    """返回应答前,view 中的事务已经结束,再次执行请求中登记的缓存失效操作"""
+    def process_request(self, request):
+        _after_commit.callbacks = OrderedDict()
+
+    def process_response(self, request, response):
+        callbacks = getattr(_after_commit, 'callbacks', None)
+        # 请求结束后不再登记
+        _after_commit.callbacks = None
+        if callbacks:
+            for func, args in callbacks:
+                func(*args)
+        return response
@@ -0,0 +1,178 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+import threading
+import socket
+import atexit
+import uuid
+import time
+import os
+
+
+# 雪花算法 id 生成器
+# 64 位 id = 41 位毫秒时间戳(从 EPOCH 开始) + 10 位机器号 + 12 位序列号
+# 同一毫秒内的 id 使用递增的序列号区分,不同进程使用不同的机器号,生成 id 不需要访问数据库
+# id 随时间单调递增,作为 InnoDB 主键时总是追加在聚簇索引的末尾,不会造成页分裂
+
+# 2019-01-01 00:00:00 UTC 的毫秒时间戳
+EPOCH = 1546300800000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# 同一毫秒内的序列号用完时等待下一毫秒,时钟回拨超过该毫秒数时不等待,借用上一次时间戳的下一毫秒
+CLOCK_BACKWARD_WAIT = 5
+
+# 机器号租约
+# 每个进程通过 set nx ex 占用一个空闲的机器号 snowflake_worker_机器号,后台线程定时续期,进程退出时释放,
+# 进程异常退出时租约在 SNOWFLAKE_LEASE_TIMEOUT 秒后过期,机器号可以被其他进程重新占用
+# 租约到期前未能续期(redis 不可用、被其他进程占用)时,不再使用该机器号,下次生成 id 时重新占用
+LEASE_KEY = 'snowflake_worker_%d'
+
+# 只续期、释放自己持有的租约
+# KEYS[1]: 租约, ARGV[1]: 持有者标识, ARGV[2]: 过期时间
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Snowflake(object):
+    """线程安全的雪花算法 id 生成器"""
+    def __init__(self, worker_id=None):
+        # 为 None 时在每个进程中第一次生成 id 时分配机器号
+        self._fixed_worker_id = worker_id
+        self._worker_id = None
+        self._pid = None
+        # 租约的持有者标识和有效期,固定机器号时有效期为 None
+        self._token = None
+        self._lease_until = None
+        self._last = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        atexit.register(self._release)
+
+    def _allocate_worker(self):
+        """
+        分配机器号
+        settings.SNOWFLAKE_WORKER_ID 不为 None 时直接使用,
+        否则从 redis incr 得到的位置开始,依次尝试占用空闲机器号的租约,同时运行的进程数不超过 1024 时不会重复
+        uwsgi 等会在导入项目后 fork 出工作进程,进程号变化时重新分配
+        """
+        if settings.SNOWFLAKE_WORKER_ID is not None:
+            self._lease_until = None
+            return settings.SNOWFLAKE_WORKER_ID & MAX_WORKER
+
+        timeout = settings.SNOWFLAKE_LEASE_TIMEOUT
+        token = '%s_%d_%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        conn = get_redis_connection('default')
+        start = conn.incr('snowflake_worker')
+        for i in range(MAX_WORKER + 1):
+            worker_id = (start + i) & MAX_WORKER
+            # 有效期从发送命令前开始计算,不会晚于 redis 中租约的实际过期时间
+            now = time.time()
+            if conn.set(LEASE_KEY % worker_id, token, nx=True, ex=timeout):
+                self._token = token
+                self._lease_until = now + timeout
+                thread = threading.Thread(target=self._heartbeat, args=(worker_id, token), daemon=True)
+                thread.start()
+                return worker_id
+
+        raise RuntimeError('没有空闲的雪花算法机器号')
+
+    def _heartbeat(self, worker_id, token):
+        """定时续期租约,租约被其他进程占用或到期前未能续期时,使当前机器号失效"""
+        while True:
+            time.sleep(settings.SNOWFLAKE_LEASE_TIMEOUT / 3.0)
+            if not self._renew(worker_id, token):
+                return
+
+    def _renew(self, worker_id, token):
+        """续期一次租约,返回是否需要继续续期"""
+        if self._token != token:
+            # 已经重新分配了机器号
+            return False
+
+        timeout = settings.SNOWFLAKE_LEASE_TIMEOUT
+        now = time.time()
+        try:
+            conn = get_redis_connection('default')
+            renewed = conn.register_script(RENEW_SCRIPT)(keys=[LEASE_KEY % worker_id], args=[token, timeout])
+        except Exception as e:
+            # redis 暂时不可用,租约到期前继续重试
+            return True
+
+        with self._lock:
+            if self._token != token:
+                return False
+            if renewed:
+                self._lease_until = now + timeout
+                return True
+            self._lease_until = 0
+            return False
+
+    def _release(self):
+        """进程退出时释放租约"""
+        if self._token is None or self._pid != os.getpid():
+            return
+        try:
+            conn = get_redis_connection('default')
+            conn.register_script(RELEASE_SCRIPT)(keys=[LEASE_KEY % self._worker_id], args=[self._token])
+        except Exception as e:
+            pass
+
+    def next_id(self):
+        with self._lock:
+            # 新进程或租约已失效时重新分配机器号
+            if self._pid != os.getpid() or (self._lease_until is not None and time.time() >= self._lease_until):
+                self._pid = os.getpid()
+                self._token = None
+                if self._fixed_worker_id is not None:
+                    self._worker_id = self._fixed_worker_id & MAX_WORKER
+                    self._lease_until = None
+                else:
+                    self._worker_id = self._allocate_worker()
+
+            now = int(time.time() * 1000)
+            # 系统时钟回拨时继续使用上一次的时间戳,保证单调递增
+            if now <= self._last:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 同一毫秒内的序列号用完
+                    now = _wait_next_millis(self._last)
+                else:
+                    now = self._last
+            else:
+                self._sequence = 0
+            self._last = now
+
+            return ((now - EPOCH) << (WORKER_BITS + SEQUENCE_BITS)) | (self._worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def _wait_next_millis(last):
+    """等待到上一次时间戳之后的毫秒,时钟回拨较多时不等待,借用下一毫秒"""
+    while True:
+        now = int(time.time() * 1000)
+        if now > last:
+            return now
+        if now < last - CLOCK_BACKWARD_WAIT:
+            return last + 1
+        time.sleep(0.0001)
+
+
+def id_time(snowflake_id):
+    """id 的生成时间(秒)"""
+    return ((int(snowflake_id) >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH) / 1000.0
+
+
+snowflake = Snowflake()